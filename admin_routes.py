@@ -1,36 +1,104 @@
 """
 Admin Portal Routes
 """
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, g, stream_template, abort, current_app
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, not_, select, update
+from sqlalchemy.orm import defer, joinedload, load_only
 from models import (
     db, User, Booking, ConversationSession, ConversationMessage, 
     Channel, ContentKnowledge, Escalation, ConversationLog
 )
 from utils.analytics import analytics_manager
 from utils.backup import backup_manager
+from utils.pagination import keyset_paginate
+from utils.cache import TTLCache
 from datetime import datetime, timedelta
+import traceback
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+# Runs the independent analytics aggregations concurrently
+_metrics_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='analytics')
+
+def _run_in_app_context(app, func, *args, **kwargs):
+    """Call func inside its own app context (and so its own scoped session)"""
+    with app.app_context():
+        return func(*args, **kwargs)
+
+def collect_metrics(start_date=None, end_date=None, days=30):
+    """Fetch conversation, booking, channel and daily metrics in parallel"""
+    app = current_app._get_current_object()
+    futures = [
+        _metrics_executor.submit(_run_in_app_context, app, analytics_manager.get_conversation_metrics, start_date, end_date),
+        _metrics_executor.submit(_run_in_app_context, app, analytics_manager.get_booking_conversion_metrics, start_date, end_date),
+        _metrics_executor.submit(_run_in_app_context, app, analytics_manager.get_channel_metrics, start_date, end_date),
+        _metrics_executor.submit(_run_in_app_context, app, analytics_manager.get_daily_stats, days=days),
+    ]
+    return [future.result() for future in futures]
+
+# Per-status escalation counts for the escalations view; assign/resolve invalidate it
+_escalation_counts_cache = TTLCache(maxsize=1, ttl=30)
+
+def get_escalation_status_counts():
+    """Count escalations per status with one GROUP BY (cached for 30s)"""
+    counts = _escalation_counts_cache.get('counts')
+    if counts is None:
+        counts = dict(db.session.execute(
+            select(Escalation.status, func.count()).group_by(Escalation.status)
+        ).all())
+        _escalation_counts_cache.set('counts', counts)
+    return counts
+
+def get_request_user():
+    """Load the logged-in user once per request (only the columns access checks need)"""
+    user = getattr(g, '_admin_user', None)
+    if user is None:
+        user = db.session.get(
+            User, session['user_id'],
+            options=[load_only(User.id, User.is_admin, User.role)]
+        )
+        g._admin_user = user
+    return user
+
+def update_or_404(model, object_id, values, returning=None):
+    """Update one row by primary key in a single statement and commit; 404 if it doesn't exist"""
+    stmt = (update(model).where(model.id == object_id).values(**values)
+            .execution_options(synchronize_session=False))
+    if returning is not None and db.session.get_bind().dialect.update_returning:
+        row = db.session.execute(stmt.returning(returning)).first()
+        if row is None:
+            abort(404)
+        db.session.commit()
+        return row[0]
+    
+    if db.session.execute(stmt).rowcount == 0:
+        abort(404)
+    value = db.session.scalar(select(returning).where(model.id == object_id)) if returning is not None else None
+    db.session.commit()
+    return value
+
 def admin_required(f):
     """Decorator to require admin access"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        is_api = request.path.startswith('/api/')
+        
         if 'user_id' not in session:
-            if request.path.startswith('/api/'):
+            if is_api:
                 return jsonify({"error": "Authentication required"}), 401
             return redirect(url_for('login'))
         
         try:
-            user = User.query.get(session['user_id'])
+            user = get_request_user()
             if not user or (not user.is_admin and user.role != 'admin'):
-                if request.path.startswith('/api/'):
+                if is_api:
                     return jsonify({"error": "Admin access required"}), 403
                 return redirect(url_for('home'))
         except Exception as e:
             print(f"Error checking admin access: {e}")
-            if request.path.startswith('/api/'):
+            if is_api:
                 return jsonify({"error": "Database error"}), 500
             return redirect(url_for('home'))
         
@@ -45,7 +113,7 @@ def role_required(*roles):
             if 'user_id' not in session:
                 return redirect(url_for('login'))
             
-            user = User.query.get(session['user_id'])
+            user = get_request_user()
             if not user or (user.role not in roles and not user.is_admin):
                 return jsonify({"error": "Insufficient permissions"}), 403
             
@@ -68,16 +136,17 @@ def dashboard():
         
         if analytics_manager:
             try:
-                conversation_metrics = analytics_manager.get_conversation_metrics()
-                booking_metrics = analytics_manager.get_booking_conversion_metrics()
-                channel_metrics = analytics_manager.get_channel_metrics()
-                daily_stats = analytics_manager.get_daily_stats(days=30)
+                conversation_metrics, booking_metrics, channel_metrics, daily_stats = collect_metrics()
             except Exception as e:
                 print(f"Analytics error: {e}")
         
         if Escalation and db:
             try:
-                recent_escalations = Escalation.query.filter_by(status='open').order_by(
+                recent_escalations = Escalation.query.options(
+                    joinedload(Escalation.assignee),
+                    joinedload(Escalation.channel),
+                    joinedload(Escalation.session)
+                ).filter_by(status='open').order_by(
                     Escalation.created_at.desc()
                 ).limit(10).all()
             except Exception as e:
@@ -85,7 +154,9 @@ def dashboard():
         
         if Booking and db:
             try:
-                recent_bookings = Booking.query.order_by(
+                recent_bookings = Booking.query.options(
+                    joinedload(Booking.user)
+                ).order_by(
                     Booking.created_at.desc()
                 ).limit(10).all()
             except Exception as e:
@@ -100,7 +171,6 @@ def dashboard():
                              recent_bookings=recent_bookings)
     except Exception as e:
         print(f"Dashboard error: {e}")
-        import traceback
         traceback.print_exc()
         return render_template('error.html', error_message=f"Error loading dashboard: {str(e)}"), 500
 
@@ -108,11 +178,12 @@ def dashboard():
 @admin_required
 def bookings():
     """Manage bookings"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 20
     
-    bookings = Booking.query.order_by(Booking.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    bookings = keyset_paginate(
+        Booking.query, (Booking.created_at, Booking.id),
+        per_page=per_page, cursor=cursor
     )
     
     return render_template('admin/bookings.html', bookings=bookings)
@@ -121,12 +192,16 @@ def bookings():
 @admin_required
 def conversations():
     """View conversations"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 20
     
-    sessions = ConversationSession.query.order_by(
-        ConversationSession.last_activity.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
+    sessions = keyset_paginate(
+        ConversationSession.query.options(
+            defer(ConversationSession.context), defer(ConversationSession.session_metadata)
+        ),
+        (ConversationSession.last_activity, ConversationSession.id),
+        per_page=per_page, cursor=cursor
+    )
     
     return render_template('admin/conversations.html', sessions=sessions)
 
@@ -134,41 +209,59 @@ def conversations():
 @admin_required
 def conversation_detail(session_id):
     """View conversation details"""
-    session_obj = ConversationSession.query.get_or_404(session_id)
-    messages = ConversationMessage.query.filter_by(
-        session_id=session_id
-    ).order_by(ConversationMessage.created_at.asc()).all()
+    session_obj = db.get_or_404(ConversationSession, session_id)
+    cursor = request.args.get('cursor')
+    
+    # Page back from the newest messages so long conversations stay bounded
+    page = keyset_paginate(
+        ConversationMessage.query.filter_by(session_id=session_id).options(
+            load_only(ConversationMessage.id, ConversationMessage.content,
+                      ConversationMessage.direction, ConversationMessage.message_type,
+                      ConversationMessage.created_at)
+        ),
+        (ConversationMessage.created_at, ConversationMessage.id),
+        per_page=200,
+        cursor=cursor
+    )
+    messages = list(reversed(page.items))
     
-    return render_template('admin/conversation_detail.html',
+    return stream_template('admin/conversation_detail.html',
                          session=session_obj,
-                         messages=messages)
+                         messages=messages,
+                         pagination=page)
 
 @admin_bp.route('/channels')
 @admin_required
 def channels():
     """Manage channels"""
-    channels_list = Channel.query.all()
+    channels_list = Channel.query.options(defer(Channel.config)).all()
     return render_template('admin/channels.html', channels=channels_list)
 
 @admin_bp.route('/channels/<int:channel_id>/toggle', methods=['POST'])
 @admin_required
 def toggle_channel(channel_id):
     """Toggle channel active status"""
-    channel = Channel.query.get_or_404(channel_id)
-    channel.is_active = not channel.is_active
-    db.session.commit()
-    return jsonify({"success": True, "is_active": channel.is_active})
+    is_active = update_or_404(Channel, channel_id,
+                              {'is_active': not_(func.coalesce(Channel.is_active, False))},
+                              returning=Channel.is_active)
+    return jsonify({"success": True, "is_active": bool(is_active)})
 
 @admin_bp.route('/content')
 @admin_required
 def content():
     """Manage knowledge base content"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 20
     
-    content_items = ContentKnowledge.query.order_by(
-        ContentKnowledge.created_at.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
+    content_items = keyset_paginate(
+        ContentKnowledge.query.options(
+            load_only(ContentKnowledge.id, ContentKnowledge.title, ContentKnowledge.category,
+                      ContentKnowledge.is_active, ContentKnowledge.priority, ContentKnowledge.views,
+                      ContentKnowledge.created_at)
+        ),
+        (ContentKnowledge.created_at, ContentKnowledge.id),
+        per_page=per_page, cursor=cursor
+    )
     
     return render_template('admin/content.html', content_items=content_items)
 
@@ -195,7 +288,7 @@ def content_new():
 @admin_required
 def content_edit(content_id):
     """Edit content"""
-    content = ContentKnowledge.query.get_or_404(content_id)
+    content = db.get_or_404(ContentKnowledge, content_id)
     
     if request.method == 'POST':
         content.title = request.form.get('title')
@@ -214,43 +307,48 @@ def content_edit(content_id):
 def escalations():
     """View escalations"""
     status = request.args.get('status', 'open')
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 20
     
-    escalations_list = Escalation.query.filter_by(status=status).order_by(
-        Escalation.created_at.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
+    escalations_list = keyset_paginate(
+        Escalation.query.filter_by(status=status).options(
+            defer(Escalation.description), defer(Escalation.stack_trace)
+        ),
+        (Escalation.created_at, Escalation.id),
+        per_page=per_page, cursor=cursor
+    )
     
     return render_template('admin/escalations.html',
                          escalations=escalations_list,
-                         current_status=status)
+                         current_status=status,
+                         status_counts=get_escalation_status_counts())
 
 @admin_bp.route('/escalations/<int:escalation_id>')
 @admin_required
 def escalation_detail(escalation_id):
     """View escalation details"""
-    escalation = Escalation.query.get_or_404(escalation_id)
+    escalation = db.get_or_404(Escalation, escalation_id)
     return render_template('admin/escalation_detail.html', escalation=escalation)
 
 @admin_bp.route('/escalations/<int:escalation_id>/assign', methods=['POST'])
 @admin_required
 def assign_escalation(escalation_id):
     """Assign escalation to user"""
-    escalation = Escalation.query.get_or_404(escalation_id)
-    escalation.assigned_to = request.json.get('user_id')
-    escalation.status = 'in_progress'
-    db.session.commit()
+    update_or_404(Escalation, escalation_id,
+                  {'assigned_to': request.json.get('user_id'), 'status': 'in_progress'})
+    _escalation_counts_cache.clear()
     return jsonify({"success": True})
 
 @admin_bp.route('/escalations/<int:escalation_id>/resolve', methods=['POST'])
 @admin_required
 def resolve_escalation(escalation_id):
     """Resolve escalation"""
-    escalation = Escalation.query.get_or_404(escalation_id)
-    escalation.status = 'resolved'
-    escalation.resolved_by = session['user_id']
-    escalation.resolved_at = datetime.utcnow()
-    db.session.commit()
+    update_or_404(Escalation, escalation_id, {
+        'status': 'resolved',
+        'resolved_by': session['user_id'],
+        'resolved_at': datetime.utcnow()
+    })
+    _escalation_counts_cache.clear()
     return jsonify({"success": True})
 
 @admin_bp.route('/analytics')
@@ -265,10 +363,7 @@ def analytics():
     if end_date:
         end_date = datetime.fromisoformat(end_date)
     
-    conversation_metrics = analytics_manager.get_conversation_metrics(start_date, end_date)
-    booking_metrics = analytics_manager.get_booking_conversion_metrics(start_date, end_date)
-    channel_metrics = analytics_manager.get_channel_metrics(start_date, end_date)
-    daily_stats = analytics_manager.get_daily_stats(days=30)
+    conversation_metrics, booking_metrics, channel_metrics, daily_stats = collect_metrics(start_date, end_date)
     
     return render_template('admin/analytics.html',
                          conversation_metrics=conversation_metrics,
@@ -276,6 +371,20 @@ def analytics():
                          channel_metrics=channel_metrics,
                          daily_stats=daily_stats)
 
+@admin_bp.route('/analytics/slot-occupancy')
+@admin_required
+def slot_occupancy():
+    """Visitors booked per time slot per date"""
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    
+    if start_date:
+        start_date = datetime.fromisoformat(start_date).date()
+    if end_date:
+        end_date = datetime.fromisoformat(end_date).date()
+    
+    return jsonify(analytics_manager.get_slot_occupancy(start_date, end_date))
+
 @admin_bp.route('/backups')
 @admin_required
 def backups():
@@ -294,11 +403,12 @@ def create_backup():
 @role_required('admin', 'manager')
 def users():
     """Manage users"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 20
     
-    users_list = User.query.order_by(User.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    users_list = keyset_paginate(
+        User.query.options(defer(User.password)), (User.created_at, User.id),
+        per_page=per_page, cursor=cursor
     )
     
     return render_template('admin/users.html', users=users_list)
@@ -307,14 +417,13 @@ def users():
 @role_required('admin')
 def update_user_role(user_id):
     """Update user role"""
-    user = User.query.get_or_404(user_id)
     new_role = request.json.get('role')
     
     if new_role in ['admin', 'manager', 'staff', 'user']:
-        user.role = new_role
+        values = {'role': new_role}
         if new_role == 'admin':
-            user.is_admin = True
-        db.session.commit()
+            values['is_admin'] = True
+        update_or_404(User, user_id, values)
         return jsonify({"success": True})
     
     return jsonify({"error": "Invalid role"}), 400
@@ -1,49 +1,103 @@
 """
 API Routes for Multi-Channel Communication
 """
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app, Response
 from functools import wraps
-from models import db, User, ConversationSession, AuthenticationToken
-from channels import WebsiteChannel, InstagramChannel, VoiceChannel
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy.orm import load_only
+from models import db, AuthenticationToken
+from channels import InstagramChannel, VoiceChannel, AudioTooLargeError
+from channels.website import cache_token, token_cache_key
 from session_manager import SessionManager
 from chatbot import get_chatbot_response
-import json
+from utils.cache import cache_manager
+import base64
+import mimetypes
+import traceback
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
-# Session manager will be initialized lazily
+@api_bp.record_once
+def init_session_manager(state):
+    """Create the app's session manager once, when the blueprint is registered"""
+    state.app.extensions.setdefault('session_manager', SessionManager())
+
 def get_session_manager():
     """Get session manager instance"""
-    if not hasattr(get_session_manager, '_instance'):
-        get_session_manager._instance = SessionManager()
-    return get_session_manager._instance
+    return current_app.extensions['session_manager']
 
 def get_website_channel():
     """Get website channel"""
     return get_session_manager()._get_channel('website')
 
+def get_instagram_channel():
+    """Get Instagram channel"""
+    return get_session_manager()._get_channel('instagram')
+
+def get_voice_channel():
+    """Get voice channel"""
+    return get_session_manager()._get_channel('voice')
+
+# Background workers for chat replies: messages posted with "async": true and Instagram DMs
+_chat_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chatbot')
+
+def _request_token():
+    """Extract the API token from the Authorization header or query string"""
+    token = request.headers.get('Authorization')
+    if token:
+        return token.replace('Bearer ', '')
+    return request.args.get('token')
+
+def _lookup_token(token):
+    """Resolve an active, unexpired token to its user_id (None if invalid)"""
+    # Shares the website channel's cache entries, so revoke_token's eviction reaches every worker
+    token_hash = AuthenticationToken.hash_token(token)
+    cached = cache_manager.get(token_cache_key(token_hash))
+    if cached is None:
+        auth_token = AuthenticationToken.query.options(
+            load_only(
+                AuthenticationToken.user_id, AuthenticationToken.expires_at,
+                AuthenticationToken.channel_id, AuthenticationToken.is_active
+            )
+        ).filter(
+            AuthenticationToken.token_matches(token)
+        ).filter_by(
+            is_active=True
+        ).first()
+        
+        if not auth_token:
+            return None
+        cache_token(token_hash, auth_token)
+        return auth_token.user_id if auth_token.is_valid() else None
+    
+    user_id, expires_ts, _ = cached
+    if expires_ts is not None and expires_ts < datetime.utcnow().timestamp():
+        return None
+    return user_id
+
+def _authenticate_request():
+    """Get the caller's user_id from the login session or an API token"""
+    if 'user_id' in session:
+        return session['user_id']
+    token = _request_token()
+    return _lookup_token(token) if token else None
+
 def token_required(f):
     """Decorator for token-based authentication"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if token:
-            token = token.replace('Bearer ', '')
-        else:
-            token = request.args.get('token')
+        token = _request_token()
         
         if not token:
             return jsonify({"error": "Token required"}), 401
         
-        auth_token = AuthenticationToken.query.filter_by(
-            token=token,
-            is_active=True
-        ).first()
+        user_id = _lookup_token(token)
         
-        if not auth_token or not auth_token.is_valid():
+        if not user_id:
             return jsonify({"error": "Invalid or expired token"}), 401
         
-        request.user_id = auth_token.user_id
+        request.user_id = user_id
         return f(*args, **kwargs)
     
     return decorated_function
@@ -58,20 +112,43 @@ def websocket_info():
         "token_required": True
     })
 
+def _bot_reply(message):
+    """Get the chatbot response for a message"""
+    if get_chatbot_response:
+        return get_chatbot_response(message)
+    return "I'm sorry, the chatbot service is temporarily unavailable."
+
+def _respond_in_background(app, session_id, message):
+    """Generate and save the bot reply outside the request"""
+    with app.app_context():
+        try:
+            channel = get_website_channel()
+            session_obj = channel.get_session(session_id=session_id)
+            if session_obj:
+                channel.send_message(session_obj, _bot_reply(message))
+                db.session.commit()
+        except Exception as e:
+            print(f"Background chat response error: {e}")
+
+def _reply_on_instagram_in_background(app, session_id, message_texts):
+    """Generate bot replies and send them, in order, over the Graph API outside the webhook request"""
+    with app.app_context():
+        try:
+            instagram_channel = get_instagram_channel()
+            session_obj = instagram_channel.get_session(session_id=session_id)
+            if session_obj:
+                for message_text in message_texts:
+                    instagram_channel.send_message(session_obj, _bot_reply(message_text))
+                    db.session.commit()
+        except Exception as e:
+            print(f"Background Instagram reply error: {e}")
+
 @api_bp.route('/chat/message', methods=['POST'])
 def chat_message():
     """Handle chat message via API"""
     try:
         # Allow both token and session auth
-        user_id = None
-        if 'user_id' in session:
-            user_id = session['user_id']
-        else:
-            token = request.headers.get('Authorization', '').replace('Bearer ', '') or request.args.get('token')
-            if token and AuthenticationToken:
-                auth_token = AuthenticationToken.query.filter_by(token=token, is_active=True).first()
-                if auth_token and auth_token.is_valid():
-                    user_id = auth_token.user_id
+        user_id = _authenticate_request()
         
         if not user_id:
             return jsonify({"error": "Authentication required"}), 401
@@ -103,26 +180,37 @@ def chat_message():
         result = channel.receive_message(
             {'message': message},
             user_id=user_id,
-            session_id=session_obj.session_id
+            session_id=session_obj.session_id,
+            session=session_obj
         )
         
-        # Get chatbot response
-        if get_chatbot_response:
-            bot_response = get_chatbot_response(message)
-        else:
-            bot_response = "I'm sorry, the chatbot service is temporarily unavailable."
+        channel.flush()
+        message_id = result['message'].id if result and 'message' in result else None
         
-        # Save bot response
+        if data.get('async'):
+            # Reply in the background; the client polls the session history for it
+            db.session.commit()
+            _chat_executor.submit(_respond_in_background, current_app._get_current_object(),
+                                  session_obj.session_id, message)
+            return jsonify({
+                "session_id": session_obj.session_id,
+                "job_id": message_id,
+                "status": "accepted"
+            }), 202
+        
+        bot_response = _bot_reply(message)
+        
+        # Save bot response; the session and both messages go out in one commit
         channel.send_message(session_obj, bot_response)
+        db.session.commit()
         
         return jsonify({
             "session_id": session_obj.session_id,
             "response": bot_response,
-            "message_id": result['message'].id if result and 'message' in result else None
+            "message_id": message_id
         })
     except Exception as e:
         print(f"Chat message error: {e}")
-        import traceback
         traceback.print_exc()
         return jsonify({"error": "Failed to process message", "message": str(e)}), 500
 
@@ -137,26 +225,21 @@ def create_chat_session():
         user_id=request.user_id,
         channel_user_id=str(request.user_id)
     )
+    channel.flush()
     
-    return jsonify({
+    response = jsonify({
         "session_id": session_obj.session_id,
         "created_at": session_obj.created_at.isoformat()
     })
+    db.session.commit()
+    return response
 
 @api_bp.route('/chat/session/<session_id>/history', methods=['GET'])
 def get_chat_history(session_id):
     """Get chat history"""
     try:
         # Allow both token and session auth
-        user_id = None
-        if 'user_id' in session:
-            user_id = session['user_id']
-        else:
-            token = request.headers.get('Authorization', '').replace('Bearer ', '') or request.args.get('token')
-            if token and AuthenticationToken:
-                auth_token = AuthenticationToken.query.filter_by(token=token, is_active=True).first()
-                if auth_token and auth_token.is_valid():
-                    user_id = auth_token.user_id
+        user_id = _authenticate_request()
         
         if not user_id:
             return jsonify({"error": "Authentication required"}), 401
@@ -170,15 +253,7 @@ def get_chat_history(session_id):
         if session_obj.user_id != user_id:
             return jsonify({"error": "Unauthorized"}), 403
         
-        history = get_session_manager().get_conversation_history(session_obj)
-        
-        messages = [{
-            "id": msg.id,
-            "content": msg.content,
-            "direction": msg.direction,
-            "message_type": msg.message_type,
-            "created_at": msg.created_at.isoformat()
-        } for msg in history]
+        messages = get_session_manager().get_conversation_history_rows(session_obj)
         
         return jsonify({
             "session_id": session_id,
@@ -197,7 +272,7 @@ def instagram_webhook():
         if not InstagramChannel:
             return jsonify({"error": "Instagram channel not available"}), 503
         
-        instagram_channel = InstagramChannel()
+        instagram_channel = get_instagram_channel()
         
         if request.method == 'GET':
             # Webhook verification
@@ -210,32 +285,21 @@ def instagram_webhook():
                 return result, 200
             return "Forbidden", 403
         
-        # Handle webhook event
-        data = request.json or {}
-        entry = data.get('entry', [])
-        
-        for entry_item in entry:
-            messaging = entry_item.get('messaging', [])
-            for message_event in messaging:
-                result = instagram_channel.receive_message({'entry': [entry_item]})
-                
-                if result:
-                    session_obj = result['session']
-                    message_text = result['message'].content
-                    
-                    # Get chatbot response
-                    if get_chatbot_response:
-                        bot_response = get_chatbot_response(message_text)
-                    else:
-                        bot_response = "Thank you for your message!"
-                    
-                    # Send response via Instagram
-                    instagram_channel.send_message(session_obj, bot_response)
+        # Handle webhook event: store every messaging event in one commit, then reply in the
+        # background so Meta gets its ACK without waiting on the Graph API
+        results = instagram_channel.receive_messages(request.json or {})
+        replies = {}  # session_id -> inbound texts, so each conversation is answered in order
+        for result in results:
+            replies.setdefault(result['session'].session_id, []).append(result['message'].content)
+        db.session.commit()
+        
+        app = current_app._get_current_object()
+        for session_id, message_texts in replies.items():
+            _chat_executor.submit(_reply_on_instagram_in_background, app, session_id, message_texts)
         
         return jsonify({"success": True}), 200
     except Exception as e:
         print(f"Instagram webhook error: {e}")
-        import traceback
         traceback.print_exc()
         return jsonify({"error": "Webhook processing failed", "message": str(e)}), 500
 
@@ -248,7 +312,7 @@ def voice_transcribe():
         if not VoiceChannel:
             return jsonify({"error": "Voice channel not available"}), 503
         
-        voice_channel = VoiceChannel()
+        voice_channel = get_voice_channel()
         
         audio_data = request.files.get('audio')
         language = request.form.get('language', 'en-US')
@@ -256,8 +320,7 @@ def voice_transcribe():
         if not audio_data:
             return jsonify({"error": "No audio file provided"}), 400
         
-        audio_bytes = audio_data.read()
-        transcription = voice_channel.transcribe_audio(audio_bytes, language)
+        transcription = voice_channel.transcribe_audio(audio_data.stream, language)
         
         if not transcription:
             return jsonify({"error": "Transcription failed"}), 500
@@ -266,6 +329,8 @@ def voice_transcribe():
             "text": transcription['text'],
             "confidence": transcription.get('confidence', 0)
         })
+    except AudioTooLargeError as e:
+        return jsonify({"error": "Audio too large", "message": str(e)}), 413
     except Exception as e:
         print(f"Voice transcribe error: {e}")
         return jsonify({"error": "Transcription error", "message": str(e)}), 500
@@ -277,7 +342,7 @@ def voice_synthesize():
         if not VoiceChannel:
             return jsonify({"error": "Voice channel not available"}), 503
         
-        voice_channel = VoiceChannel()
+        voice_channel = get_voice_channel()
         
         data = request.json or {}
         text = data.get('text')
@@ -292,9 +357,8 @@ def voice_synthesize():
         if not audio_result:
             return jsonify({"error": "Synthesis failed"}), 500
         
-        # Return audio as base64
-        import base64
-        audio_base64 = base64.b64encode(audio_result['audio_data']).decode()
+        # Return audio as base64 (use /voice/synthesize/raw to skip the encoding)
+        audio_base64 = base64.b64encode(memoryview(audio_result['audio_data'])).decode()
         
         return jsonify({
             "audio_data": audio_base64,
@@ -304,6 +368,34 @@ def voice_synthesize():
         print(f"Voice synthesize error: {e}")
         return jsonify({"error": "Synthesis error", "message": str(e)}), 500
 
+@api_bp.route('/voice/synthesize/raw', methods=['POST'])
+def voice_synthesize_raw():
+    """Synthesize text to speech and return the audio bytes directly"""
+    try:
+        if not VoiceChannel:
+            return jsonify({"error": "Voice channel not available"}), 503
+        
+        voice_channel = get_voice_channel()
+        
+        data = request.json or {}
+        text = data.get('text')
+        language = data.get('language', 'en-US')
+        voice = data.get('voice', 'en-US-Standard-B')
+        
+        if not text:
+            return jsonify({"error": "No text provided"}), 400
+        
+        audio_result = voice_channel.synthesize_speech(text, language, voice)
+        
+        if not audio_result:
+            return jsonify({"error": "Synthesis failed"}), 500
+        
+        mimetype = mimetypes.types_map.get(f".{audio_result['format']}", 'application/octet-stream')
+        return Response(audio_result['audio_data'], mimetype=mimetype)
+    except Exception as e:
+        print(f"Voice synthesize error: {e}")
+        return jsonify({"error": "Synthesis error", "message": str(e)}), 500
+
 @api_bp.route('/voice/message', methods=['POST'])
 def voice_message():
     """Handle voice message (transcribe, process, synthesize)"""
@@ -311,7 +403,7 @@ def voice_message():
         if not VoiceChannel:
             return jsonify({"error": "Voice channel not available"}), 503
         
-        voice_channel = VoiceChannel()
+        voice_channel = get_voice_channel()
         
         audio_data = request.files.get('audio')
         phone_number = request.form.get('phone_number')
@@ -320,11 +412,9 @@ def voice_message():
         if not audio_data:
             return jsonify({"error": "No audio file provided"}), 400
         
-        audio_bytes = audio_data.read()
-        
         # Receive and transcribe
         result = voice_channel.receive_message(
-            {'audio_data': audio_bytes},
+            {'audio_data': audio_data.stream},
             phone_number=phone_number,
             language=language
         )
@@ -332,6 +422,16 @@ def voice_message():
         if not result:
             return jsonify({"error": "Failed to process voice message"}), 500
         
+        if result['message'] is None:
+            # Low-confidence or empty transcription: skip the chatbot, TTS and DB writes
+            audio_result = voice_channel.get_not_understood_audio(language)
+            return jsonify({
+                "error": "Could not understand audio",
+                "response_text": voice_channel.NOT_UNDERSTOOD_MESSAGE,
+                "response_audio": base64.b64encode(memoryview(audio_result['audio_data'])).decode() if audio_result else None,
+                "format": audio_result['format'] if audio_result else None
+            }), 400
+        
         session_obj = result['session']
         message_text = result['message'].content
         
@@ -345,13 +445,15 @@ def voice_message():
         audio_result = voice_channel.synthesize_speech(bot_response, language)
         
         if not audio_result:
+            # Still keep the transcribed inbound message (and a new session)
+            db.session.commit()
             return jsonify({"error": "Failed to synthesize response"}), 500
         
         # Save bot response
         voice_channel.send_message(session_obj, bot_response, language=language)
+        db.session.commit()
         
-        import base64
-        audio_base64 = base64.b64encode(audio_result['audio_data']).decode()
+        audio_base64 = base64.b64encode(memoryview(audio_result['audio_data'])).decode()
         
         return jsonify({
             "session_id": session_obj.session_id,
@@ -359,9 +461,10 @@ def voice_message():
             "response_audio": audio_base64,
             "format": audio_result['format']
         })
+    except AudioTooLargeError as e:
+        return jsonify({"error": "Audio too large", "message": str(e)}), 413
     except Exception as e:
         print(f"Voice message error: {e}")
-        import traceback
         traceback.print_exc()
         return jsonify({"error": "Voice message processing failed", "message": str(e)}), 500
 
@@ -408,9 +511,9 @@ def list_tokens():
             "tokens": [{
                 "id": token.id,
                 "name": token.name,
-                "created_at": token.created_at.isoformat(),
-                "expires_at": token.expires_at.isoformat() if token.expires_at else None,
-                "last_used": token.last_used.isoformat() if token.last_used else None
+                "created_at": token.created_at,
+                "expires_at": token.expires_at,
+                "last_used": token.last_used
             } for token in tokens]
         })
     except Exception as e:
@@ -427,13 +530,16 @@ def revoke_token(token_id):
         if not AuthenticationToken or not db:
             return jsonify({"error": "Token system not available"}), 503
         
-        token = AuthenticationToken.query.get_or_404(token_id)
+        token = db.get_or_404(AuthenticationToken, token_id)
         
         if token.user_id != session['user_id']:
             return jsonify({"error": "Unauthorized"}), 403
         
         token.is_active = False
         db.session.commit()
+        # Caches are keyed by digest; a pre-hashing token's stored value is the raw token, so hash it too
+        token_hashes = {token.token, AuthenticationToken.hash_token(token.token)}
+        cache_manager.delete(*(token_cache_key(token_hash) for token_hash in token_hashes))
         
         return jsonify({"success": True})
     except Exception as e:
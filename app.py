@@ -1,45 +1,105 @@
-from flask import Flask, render_template, redirect, url_for, request, session, jsonify
+if __name__ == '__main__':
+    # Green sockets for the SocketIO server; must happen before anything else imports socket/threading
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, render_template, redirect, url_for, request, session, jsonify, g
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.record_queries import get_recorded_queries
 from flask_babel import Babel
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import stripe
+import redis
 from flask_cors import CORS
-from models import db, User, Ticket, Booking, Escalation
+from flask_session import Session
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.routing import BaseConverter, ValidationError
+from models import db, User, Ticket, Booking, Escalation, JSON_ENGINE_OPTIONS
 from chatbot import get_chatbot_response
 from dotenv import load_dotenv
 import os
 import re
+import zlib
+import time
+import tempfile
+import queue
+import threading
 from datetime import datetime, date, timedelta
+from types import MappingProxyType
 from flask_migrate import Migrate
 from admin_routes import admin_bp
 from api_routes import api_bp
-from session_manager import SessionManager
 from channels import WebsiteChannel
 from utils.analytics import analytics_manager
-from functools import wraps
+from utils.json_provider import ORJSONProvider, ORJSONSocketIO
+from utils.cache import cache_manager
+from functools import lru_cache, wraps
+from sqlalchemy import insert, literal, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import joinedload
 
 load_dotenv()
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+# Match "/path" and "/path/" alike instead of redirecting; must be set before any route is added
+app.url_map.strict_slashes = False
 
 app.config['BABEL_DEFAULT_LOCALE'] = os.getenv('BABEL_DEFAULT_LOCALE', 'en')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///dev.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(JSON_ENGINE_OPTIONS)
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Room for admin + API concurrency; pre-ping and recycle drop stale server-side connections
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '20')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '40')),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'pool_use_lifo': True,
+    })
+    if make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_driver_name() == 'psycopg2':
+        # INSERTs are already batched (insertmanyvalues); this batches executemany UPDATE/DELETEs too
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+            'executemany_mode': 'values_plus_batch',
+            'executemany_batch_page_size': 500,
+        })
+# With Redis available, keep session data (e.g. chatbot booking state) server-side; only the ID goes in the cookie
+if os.getenv('REDIS_URL'):
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.Redis.from_url(os.getenv('REDIS_URL'))
+    app.config['SESSION_PERMANENT'] = False
+    Session(app)
 app.config['STRIPE_PUBLIC_KEY'] = os.getenv('STRIPE_PUBLIC_KEY')
 app.config['STRIPE_SECRET_KEY'] = os.getenv('STRIPE_SECRET_KEY')
+app.config['STRIPE_WEBHOOK_SECRET'] = os.getenv('STRIPE_WEBHOOK_SECRET')
+
+# Cap request bodies (audio uploads); larger multipart files spill to disk instead of RAM
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', str(25 * 1024 * 1024)))
+app.config['MAX_FORM_MEMORY_SIZE'] = int(os.getenv('MAX_FORM_MEMORY_SIZE', str(500 * 1024)))
+
+# Dev-only: record SQL per request and warn on likely N+1 patterns
+app.config['SQLALCHEMY_RECORD_QUERIES'] = os.getenv('SQLALCHEMY_RECORD_QUERIES', 'false').lower() == 'true'
+app.config['QUERY_COUNT_WARNING'] = int(os.getenv('QUERY_COUNT_WARNING', '10'))
+
+# Reuse compiled templates across worker restarts. TEMPLATES_AUTO_RELOAD is left at Flask's
+# default, so templates are only re-checked on disk (a stat per render) in debug mode.
+jinja_cache_dir = os.getenv('JINJA_BYTECODE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'museumhub_jinja_cache'))
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
 
 db.init_app(app)
 migrate = Migrate(app, db)
 babel = Babel()
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", json=ORJSONSocketIO)
 
 # Register blueprints
 app.register_blueprint(admin_bp)
 app.register_blueprint(api_bp)
 
-# Initialize session manager (channels will be lazy-loaded)
-session_manager = SessionManager()
+# Session manager shared with the API blueprint (channels will be lazy-loaded)
+session_manager = app.extensions['session_manager']
 
 def get_website_channel():
     """Get website channel (lazy initialization)"""
@@ -64,23 +124,181 @@ def login_required(f):
 # ------------------------------
 # Museum booking config
 # ------------------------------
-TIME_SLOTS = [
+TIME_SLOTS = (
     "9AM–10AM",
     "10AM–11AM",
     "11AM–12PM",
     "1PM–2PM",
     "2PM–3PM",
     "3PM–4PM"
-]
+)
 
-SLOT_CAPACITY = {
+SLOT_CAPACITY = MappingProxyType({
     "9AM–10AM": 20,
     "10AM–11AM": 25,
     "11AM–12PM": 25,
     "1PM–2PM": 30,
     "2PM–3PM": 30,
     "3PM–4PM": 20
-}
+})
+
+# Price per visitor (in cents for Stripe)
+TICKET_PRICE = 100  # $1.00 or Rs 100 (adjust based on currency)
+
+# Availability is re-read at most this often (seconds); bookings and cancellations invalidate it
+AVAILABILITY_CACHE_TTL = int(os.getenv('AVAILABILITY_CACHE_TTL', '8'))
+# Chatbot date lookups also warm this many following days, so "Try Tomorrow"/"Next Week" hit the cache
+AVAILABILITY_PREFETCH_DAYS = 7
+# Longest date range served by the bulk availability endpoint
+AVAILABILITY_RANGE_MAX_DAYS = 31
+
+# Precomputed for constant-time slot validation and availability building
+TIME_SLOTS_SET = frozenset(TIME_SLOTS)
+SLOT_CAPACITY_TUPLES = tuple((slot, SLOT_CAPACITY.get(slot, 20)) for slot in TIME_SLOTS)
+SLOT_LABELS = MappingProxyType({slot: f"⏰ {slot}" for slot in TIME_SLOTS})
+
+def get_today():
+    """Today's date, looked up once per request"""
+    if 'today' not in g:
+        g.today = date.today()
+    return g.today
+
+# fromisoformat also takes other ISO forms (e.g. week dates like 2024-W01-1); only accept YYYY-MM-DD
+ISO_DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}', re.ASCII)
+
+@lru_cache(maxsize=64)
+def _parse_iso_date(date_str):
+    return date.fromisoformat(date_str)
+
+def parse_date(date_str):
+    """Parse a YYYY-MM-DD string into a date, raising ValueError if it isn't one"""
+    if not isinstance(date_str, str) or not ISO_DATE_PATTERN.fullmatch(date_str):
+        raise ValueError(f"Invalid date: {date_str!r}")
+    return _parse_iso_date(date_str)
+
+class IsoDateConverter(BaseConverter):
+    """URL converter for YYYY-MM-DD segments; the view receives a date"""
+    regex = r"\d{4}-\d{2}-\d{2}"
+
+    def to_python(self, value):
+        try:
+            return parse_date(value)
+        except ValueError:
+            raise ValidationError()
+
+    def to_url(self, value):
+        return value.isoformat() if isinstance(value, date) else str(value)
+
+app.url_map.converters['isodate'] = IsoDateConverter
+
+def availability_cache_key(target_date):
+    """Cache key for a date's per-slot booked counts"""
+    return f"avail:{target_date.isoformat()}"
+
+def prefetch_slot_counts(start_date, end_date):
+    """Booked visitors per slot for every day in [start_date, end_date] from one GROUP BY query; caches each day"""
+    counts_by_day = {start_date + timedelta(days=offset): {} for offset in range((end_date - start_date).days + 1)}
+    for booking_date, time_slot, booked in db.session.query(
+        Booking.date, Booking.time_slot, db.func.coalesce(db.func.sum(Booking.visitors), 0)
+    ).filter(Booking.date.between(start_date, end_date)).group_by(Booking.date, Booking.time_slot):
+        counts_by_day[booking_date][time_slot] = int(booked)
+    cache_manager.set_many(
+        {availability_cache_key(day): counts for day, counts in counts_by_day.items()}, AVAILABILITY_CACHE_TTL
+    )
+    return counts_by_day
+
+def get_slot_counts(target_date, prefetch_days=0):
+    """Visitors booked per time slot on a date, from a single GROUP BY query (cached briefly)
+
+    On a miss with prefetch_days, the following days are loaded and cached by the same query.
+    """
+    key = availability_cache_key(target_date)
+    counts = cache_manager.get(key)
+    if counts is None:
+        if prefetch_days:
+            return prefetch_slot_counts(target_date, target_date + timedelta(days=prefetch_days))[target_date]
+        counts = {
+            time_slot: int(booked)
+            for time_slot, booked in db.session.query(
+                Booking.time_slot, db.func.coalesce(db.func.sum(Booking.visitors), 0)
+            ).filter(Booking.date == target_date).group_by(Booking.time_slot)
+        }
+        cache_manager.set(key, counts, AVAILABILITY_CACHE_TTL)
+    return counts
+
+def get_slot_availability(target_date, counts=None):
+    """Capacity, booked and remaining places for every time slot on a date"""
+    if counts is None:
+        counts = get_slot_counts(target_date)
+    booked = [int(counts.get(slot, 0)) for slot in TIME_SLOTS]
+    return [
+        {
+            "time_slot": slot,
+            "capacity": capacity,
+            "booked": booked_sum,
+            "remaining": max(0, capacity - booked_sum),
+            "is_full": booked_sum >= capacity
+        }
+        for (slot, capacity), booked_sum in zip(SLOT_CAPACITY_TUPLES, booked)
+    ]
+
+def _insert_booking_if_available(user_id, target_date, time_slot, visitors, **fields):
+    """Run the capacity-checked booking INSERT in the current transaction, without committing.
+
+    Returns (booking_id, None) if it was inserted, or (None, remaining_places) if the slot can't fit the party.
+    """
+    capacity = SLOT_CAPACITY.get(time_slot, 20)
+    values = dict(user_id=user_id, date=target_date, time_slot=time_slot, visitors=visitors, **fields)
+    columns = Booking.__table__.c
+    
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # READ COMMITTED can't see concurrent uncommitted rows; serialize inserts per slot
+        db.session.execute(select(db.func.pg_advisory_xact_lock(_slot_lock_key(target_date, time_slot))))
+    
+    booked_sum = select(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
+        .where(Booking.date == target_date, Booking.time_slot == time_slot).scalar_subquery()
+    stmt = insert(Booking).from_select(
+        list(values),
+        select(*[literal(value, columns[name].type) for name, value in values.items()])
+        .where(booked_sum + visitors <= capacity)
+    )
+    
+    if db.session.get_bind().dialect.insert_returning:
+        booking_id = db.session.scalar(stmt.returning(Booking.id))
+    else:
+        result = db.session.execute(stmt)
+        booking_id = result.lastrowid if result.rowcount else None
+    
+    if booking_id is None:
+        booked = db.session.scalar(select(booked_sum))
+        return None, max(0, capacity - int(booked))
+    return booking_id, None
+
+def _slot_lock_key(target_date, time_slot):
+    """Advisory lock key serializing booking inserts for one slot"""
+    return zlib.crc32(f"{target_date}|{time_slot}".encode())
+
+def create_booking_if_available(user_id, target_date, time_slot, visitors, **fields):
+    """Insert a booking only if the slot still has room, checking capacity in the same statement.
+
+    Returns (booking, None) on success, or (None, remaining_places) if the slot can't fit the party.
+    """
+    try:
+        booking_id, remaining = _insert_booking_if_available(user_id, target_date, time_slot, visitors, **fields)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if booking_id is None:
+        return None, remaining
+    cache_manager.delete(availability_cache_key(target_date))
+    return db.session.get(Booking, booking_id), None
+
+def get_user_booking(booking_id):
+    """Load a booking only if it belongs to the logged-in user (None otherwise)"""
+    return db.session.execute(
+        select(Booking).where(Booking.id == booking_id, Booking.user_id == session["user_id"])
+    ).scalar_one_or_none()
 
 # ------------------------------
 # Locale functions
@@ -144,11 +362,8 @@ def admin_portal_page():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    try:
-        user = User.query.get(session['user_id'])
-        if not user or (not getattr(user, 'is_admin', False) and getattr(user, 'role', None) != 'admin'):
-            return redirect(url_for('home'))
-    except:
+    # The login claim is enough here; admin_required re-checks the user on the dashboard itself
+    if not session.get('is_admin'):
         return redirect(url_for('home'))
     
     # Redirect to admin dashboard
@@ -201,7 +416,8 @@ def register():
             return render_template('register.html', error="Username already exists")
         
         # Create user with email if provided
-        user = User(username=username, password=password, email=email if email else None)
+        user = User(username=username, email=email if email else None)
+        user.set_password(password)
         db.session.add(user)
         db.session.commit()
         
@@ -226,8 +442,10 @@ def login():
         if not username or not password:
             return render_template('login.html', error="Username and password are required")
         
-        user = User.query.filter_by(username=username, password=password).first()
-        if user:
+        user = User.query.filter_by(username=username).first()
+        if user and user.check_password(password):
+            if db.session.is_modified(user):
+                db.session.commit()  # legacy plaintext password was just hashed
             session['user_id'] = user.id
             session['username'] = user.username
             session['is_admin'] = getattr(user, 'is_admin', False) or (getattr(user, 'role', None) == 'admin')
@@ -244,27 +462,22 @@ def login():
 # ------------------------------
 # Booking API
 # ------------------------------
-@app.route("/api/availability/<date_str>")
-def api_availability(date_str):
-    try:
-        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-    except:
-        return jsonify({"error": "Date must be YYYY-MM-DD"}), 400
-
-    slots_data = []
-    for slot in TIME_SLOTS:
-        booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-            .filter_by(date=target_date, time_slot=slot).scalar() or 0
-        capacity = SLOT_CAPACITY.get(slot, 20)
-        slots_data.append({
-            "time_slot": slot,
-            "capacity": capacity,
-            "booked": int(booked_sum),
-            "remaining": max(0, int(capacity - booked_sum)),
-            "is_full": booked_sum >= capacity
-        })
+@app.route("/api/availability/<isodate:target_date>")
+def api_availability(target_date):
+    slots_data = get_slot_availability(target_date)
     return jsonify({"date": target_date.isoformat(), "slots": slots_data})
 
+@app.route("/api/availability/<isodate:start_date>/<isodate:end_date>")
+def api_availability_range(start_date, end_date):
+    if end_date < start_date or (end_date - start_date).days >= AVAILABILITY_RANGE_MAX_DAYS:
+        return jsonify({"error": "invalid_date_range", "max_days": AVAILABILITY_RANGE_MAX_DAYS}), 400
+    counts_by_day = prefetch_slot_counts(start_date, end_date)
+    return jsonify({
+        "start": start_date.isoformat(),
+        "end": end_date.isoformat(),
+        "days": {day.isoformat(): get_slot_availability(day, counts) for day, counts in counts_by_day.items()}
+    })
+
 @app.route("/api/book", methods=["POST"])
 def api_book():
     if "user_id" not in session:
@@ -279,24 +492,18 @@ def api_book():
         return jsonify({"error": "missing_date_or_slot"}), 400
 
     try:
-        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-    except:
+        target_date = parse_date(date_str)
+    except ValueError:
         return jsonify({"error": "invalid_date_format"}), 400
 
-    if time_slot not in TIME_SLOTS:
+    if time_slot not in TIME_SLOTS_SET:
         return jsonify({"error": "invalid_time_slot"}), 400
 
-    booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-        .filter_by(date=target_date, time_slot=time_slot).scalar() or 0
-    capacity = SLOT_CAPACITY.get(time_slot, 20)
+    booking, available = create_booking_if_available(session["user_id"], target_date, time_slot, visitors)
 
-    if booked_sum + visitors > capacity:
+    if booking is None:
         return jsonify({"error": "slot_full_or_not_enough_capacity",
-                        "available": max(0, capacity - booked_sum)}), 409
-
-    booking = Booking(user_id=session["user_id"], date=target_date, time_slot=time_slot, visitors=visitors)
-    db.session.add(booking)
-    db.session.commit()
+                        "available": available}), 409
 
     return jsonify({"message": "booking_confirmed", "booking": booking.to_dict()}), 201
 
@@ -306,7 +513,7 @@ def api_book():
 @app.route("/calendar")
 @login_required
 def calendar_page():
-    today = date.today()
+    today = get_today()
     year = request.args.get("year", today.year, type=int)
     month = request.args.get("month", today.month, type=int)
 
@@ -323,8 +530,11 @@ def day_view():
     date_str = request.args.get("date")
     if not date_str:
         return redirect(url_for('calendar_page'))
-    availability = api_availability(date_str).get_json()
-    return render_template("day_view.html", date=date_str, slots=availability["slots"])
+    try:
+        target_date = parse_date(date_str)
+    except ValueError:
+        return redirect(url_for('calendar_page'))
+    return render_template("day_view.html", date=date_str, slots=get_slot_availability(target_date))
 
 @app.route('/book_ticket', methods=['GET', 'POST'])
 @login_required
@@ -341,39 +551,32 @@ def book_ticket():
                                    visitors=visitors, slots=TIME_SLOTS)
 
         try:
-            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-        except:
+            target_date = parse_date(date_str)
+        except ValueError:
             return render_template("booking_form.html",
                                    error="invalid_date_format", date=date_str, time_slot=time_slot,
                                    visitors=visitors, slots=TIME_SLOTS)
 
-        if time_slot not in TIME_SLOTS:
+        if time_slot not in TIME_SLOTS_SET:
             return render_template("booking_form.html",
                                    error="invalid_time_slot", date=date_str, time_slot=time_slot,
                                    visitors=visitors, slots=TIME_SLOTS)
 
-        # Check availability
-        booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-            .filter_by(date=target_date, time_slot=time_slot).scalar() or 0
-        capacity = SLOT_CAPACITY.get(time_slot, 20)
+        # Create booking if the slot still has room (default payment status: pending)
+        booking, _ = create_booking_if_available(
+            session["user_id"], target_date, time_slot, visitors,
+            amount=float(visitors * TICKET_PRICE), currency='USD', payment_status='pending'
+        )
 
-        if booked_sum + visitors > capacity:
+        if booking is None:
                 return render_template("booking_form.html",
                                    error="slot_full_or_not_enough_capacity", date=date_str, time_slot=time_slot,
                                        visitors=visitors, slots=TIME_SLOTS)
 
-        # Create booking
-        booking = Booking(user_id=session["user_id"], date=target_date, time_slot=time_slot, visitors=visitors)
-        booking.amount = booking.calculate_amount(TICKET_PRICE)
-        booking.currency = 'USD'
-        booking.payment_status = 'pending'  # Default to pending
-        db.session.add(booking)
-        db.session.commit()
-
         # Redirect to payment page (user can choose pay now or pay later)
         return redirect(url_for('payment', booking_id=booking.id))
     else:
-        date_str = request.args.get("date", date.today().isoformat())
+        date_str = request.args.get("date", get_today().isoformat())
         time_slot = request.args.get("time_slot", "")
         return render_template("booking_form.html", date=date_str, time_slot=time_slot, visitors=1, slots=TIME_SLOTS)
 
@@ -386,11 +589,13 @@ def my_bookings():
 @app.route("/cancel_booking/<int:booking_id>", methods=["POST"])
 @login_required
 def cancel_booking(booking_id):
-    booking = Booking.query.filter_by(id=booking_id, user_id=session["user_id"]).first()
+    booking = get_user_booking(booking_id)
     if not booking:
         return "Booking not found", 404
+    booking_date = booking.date
     db.session.delete(booking)
     db.session.commit()
+    cache_manager.delete(availability_cache_key(booking_date))
     return redirect(url_for('my_bookings'))
 
 # ------------------------------
@@ -401,35 +606,32 @@ def admin_bookings():
     if not session.get("is_admin"):
         return "Access denied", 403
 
+    # The template shows each booking's user, so load them in the same query
+    query = Booking.query.options(joinedload(Booking.user))
     date_str = request.args.get("date")
     if date_str:
         try:
-            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            bookings = Booking.query.filter_by(date=target_date).order_by(Booking.time_slot).all()
-        except:
-            bookings = Booking.query.order_by(Booking.date.desc()).limit(100).all()
+            target_date = parse_date(date_str)
+            bookings = query.filter_by(date=target_date).order_by(Booking.time_slot).all()
+        except ValueError:
+            bookings = query.order_by(Booking.date.desc()).limit(100).all()
     else:
-        bookings = Booking.query.order_by(Booking.date.desc()).limit(200).all()
+        bookings = query.order_by(Booking.date.desc()).limit(200).all()
 
     return render_template("admin_bookings.html", bookings=bookings)
 
 # ------------------------------
 # Payment Gateway Module
 # ------------------------------
-# Price per visitor (in cents for Stripe)
-TICKET_PRICE = 100  # $1.00 or Rs 100 (adjust based on currency)
-
 @app.route('/payment/<int:booking_id>', methods=['GET', 'POST'])
 def payment(booking_id):
     """Payment page for a booking"""
     if "user_id" not in session:
         return redirect(url_for('login'))
     
-    booking = Booking.query.get_or_404(booking_id)
-    
-    # Verify booking belongs to user
-    if booking.user_id != session["user_id"]:
-        return "Access denied", 403
+    booking = get_user_booking(booking_id)
+    if not booking:
+        return "Booking not found", 404
     
     # Check if already paid
     if booking.payment_status == 'paid':
@@ -442,55 +644,8 @@ def payment(booking_id):
         db.session.commit()
         return redirect(url_for('booking_confirmed', booking_id=booking_id))
     
-    # Calculate amount
+    # Card payments are created via /create-payment-intent and confirmed client-side
     amount = booking.calculate_amount(TICKET_PRICE)
-    amount_cents = int(amount * 100)  # Convert to cents for Stripe
-    
-    if request.method == 'POST':
-        try:
-            # Create Payment Intent
-            payment_intent = stripe.PaymentIntent.create(
-                amount=amount_cents,
-                currency=booking.currency.lower() if booking.currency else 'usd',
-                payment_method=request.form.get('payment_method_id'),
-                confirmation_method='manual',
-                confirm=True,
-                metadata={
-                    'booking_id': booking.id,
-                    'user_id': session['user_id']
-                }
-            )
-            
-            # Update booking with payment info
-            booking.payment_intent_id = payment_intent.id
-            booking.payment_status = 'paid' if payment_intent.status == 'succeeded' else 'pending'
-            booking.amount = amount
-            booking.currency = booking.currency or 'USD'
-            booking.payment_method = 'card'
-            booking.transaction_id = payment_intent.id
-            booking.paid_at = datetime.utcnow()
-            db.session.commit()
-            
-            if payment_intent.status == 'succeeded':
-                return redirect(url_for('payment_success', booking_id=booking_id))
-            else:
-                return render_template('payment.html', 
-                                    booking=booking, 
-                                    amount=amount,
-                                    stripe_public_key=app.config['STRIPE_PUBLIC_KEY'],
-                                    error="Payment processing. Please wait...")
-        except stripe.error.CardError as e:
-            return render_template('payment.html', 
-                                booking=booking, 
-                                amount=amount,
-                                stripe_public_key=app.config['STRIPE_PUBLIC_KEY'],
-                                error=str(e))
-        except Exception as e:
-            return render_template('payment.html', 
-                                booking=booking, 
-                                amount=amount,
-                                stripe_public_key=app.config['STRIPE_PUBLIC_KEY'],
-                                error=f"An error occurred: {str(e)}")
     
     return render_template('payment.html', 
                           booking=booking, 
@@ -503,10 +658,9 @@ def create_payment_intent(booking_id):
     if "user_id" not in session:
         return jsonify({"error": "Not authenticated"}), 401
     
-    booking = Booking.query.get_or_404(booking_id)
-    
-    if booking.user_id != session["user_id"]:
-        return jsonify({"error": "Access denied"}), 403
+    booking = get_user_booking(booking_id)
+    if not booking:
+        return jsonify({"error": "Booking not found"}), 404
     
     if booking.payment_status == 'paid':
         return jsonify({"error": "Booking already paid"}), 400
@@ -540,10 +694,9 @@ def payment_success(booking_id):
     if "user_id" not in session:
         return redirect(url_for('login'))
     
-    booking = Booking.query.get_or_404(booking_id)
-    
-    if booking.user_id != session["user_id"]:
-        return "Access denied", 403
+    booking = get_user_booking(booking_id)
+    if not booking:
+        return "Booking not found", 404
     
     return render_template('payment_success.html', booking=booking)
 
@@ -553,23 +706,22 @@ def booking_confirmed(booking_id):
     if "user_id" not in session:
         return redirect(url_for('login'))
     
-    booking = Booking.query.get_or_404(booking_id)
-    
-    if booking.user_id != session["user_id"]:
-        return "Access denied", 403
+    booking = get_user_booking(booking_id)
+    if not booking:
+        return "Booking not found", 404
     
     return render_template('booking_confirmed.html', booking=booking)
 
 @app.route('/payment-webhook', methods=['POST'])
 def payment_webhook():
     """Stripe webhook handler for payment events"""
-    payload = request.data
+    payload = request.get_data()
     sig_header = request.headers.get('Stripe-Signature')
-    endpoint_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
     
     try:
+        # The secret is read into app.config once at startup rather than from the environment per request
         event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
+            payload, sig_header, app.config['STRIPE_WEBHOOK_SECRET']
         )
     except ValueError:
         return jsonify({"error": "Invalid payload"}), 400
@@ -582,7 +734,7 @@ def payment_webhook():
         booking_id = payment_intent['metadata'].get('booking_id')
         
         if booking_id:
-            booking = Booking.query.get(booking_id)
+            booking = db.session.get(Booking, int(booking_id))
             if booking:
                 booking.payment_status = 'paid'
                 booking.paid_at = datetime.utcnow()
@@ -591,522 +743,535 @@ def payment_webhook():
     
     return jsonify({"status": "success"}), 200
 
-@app.route('/chatbot', methods=['GET', 'POST'])
-@login_required
-def chatbot():
-    if request.method == 'POST':
-        data = request.get_json()
-        user_message = data.get('message', '').strip()
-        action = data.get('action')  # For booking actions
-        step = data.get('step')  # For step-by-step booking
-        booking_data = data.get('booking_data', {})  # Store booking data
-        
-        if not user_message and not action:
-            return jsonify({"response": "Please ask me a question! I can help with booking tickets, exhibits, and more."})
-        
-        # Initialize booking session if starting booking
-        if action == 'start_booking':
-            if "user_id" not in session:
-                return jsonify({
-                    "response": "🔒 You need to be logged in to book tickets.\n\nPlease log in first, then I can help you complete your booking!",
-                    "requires_login": True,
-                    "buttons": [{"text": "🔗 Log In", "action": "login", "url": "/login"}]
-                })
-            
-            # Initialize booking state
-            session['chatbot_booking'] = {
-                'step': 'select_date',
-                'date': None,
-                'time_slot': None,
-                'visitors': None
-            }
-            session.modified = True  # Mark session as modified
-            
-            today = date.today()
-            tomorrow = today + timedelta(days=1)
-            next_week = today + timedelta(days=7)
-            
-            return jsonify({
-                "response": "🎫 Great! Let's book your ticket step by step!\n\n**Step 1: Select Date**\n\nWhen would you like to visit?",
-                "step": "select_date",
-                "buttons": [
-                    {"text": f"📅 Today ({today.strftime('%b %d')})", "action": "select_date", "value": "today"},
-                    {"text": f"📅 Tomorrow ({tomorrow.strftime('%b %d')})", "action": "select_date", "value": "tomorrow"},
-                    {"text": f"📅 Next Week ({next_week.strftime('%b %d')})", "action": "select_date", "value": next_week.isoformat()},
-                    {"text": "📅 Choose Another Date", "action": "custom_date"}
-                ],
-                "booking_data": session['chatbot_booking']
+# ------------------------------
+# Chatbot booking flow
+# ------------------------------
+# Static button sets and prompts, built once instead of on every turn
+_CHATBOT_LOGIN_BUTTONS = [{"text": "🔗 Log In", "action": "login", "url": "/login"}]
+
+_CHATBOT_START_OVER_BUTTON = {"text": "🔄 Start Over", "action": "start_booking"}
+_CHATBOT_START_NEW_BOOKING_BUTTON = {"text": "🎫 Start New Booking", "action": "start_booking"}
+_CHATBOT_VIEW_BOOKINGS_BUTTON = {"text": "📋 View All Bookings", "action": "view_bookings", "url": "/my_bookings"}
+_CHATBOT_CUSTOM_DATE_BUTTON = {"text": "📅 Choose Another Date", "action": "custom_date"}
+
+_CHATBOT_DATE_RETRY_BUTTONS = [
+    {"text": "📅 Today", "action": "select_date", "value": "today"},
+    {"text": "📅 Tomorrow", "action": "select_date", "value": "tomorrow"},
+    _CHATBOT_START_OVER_BUTTON
+]
+
+_CHATBOT_VISITOR_BUTTONS = [
+    {"text": "👤 1 Visitor", "action": "select_visitors", "value": "1"},
+    {"text": "👥 2 Visitors", "action": "select_visitors", "value": "2"},
+    {"text": "👥 3 Visitors", "action": "select_visitors", "value": "3"},
+    {"text": "👥 4 Visitors", "action": "select_visitors", "value": "4"},
+    {"text": "👥 5+ Visitors", "action": "custom_visitors"}
+]
+
+_CHATBOT_CONFIRM_BUTTONS = [
+    {"text": "💳 Pay Online Now", "action": "confirm_and_pay", "payment_type": "online"},
+    {"text": "💵 Pay Later (Cash)", "action": "confirm_and_pay", "payment_type": "cash"},
+    {"text": "✏️ Edit Booking", "action": "start_booking"}
+]
+
+_CHATBOT_CUSTOM_DATE_PROMPT = {
+    "response": "📅 Please enter the date in YYYY-MM-DD format (e.g., 2024-12-25)\n\nOr type the date you'd like to visit.",
+    "step": "custom_date_input",
+    "input_type": "date"
+}
+
+_CHATBOT_CUSTOM_VISITORS_PROMPT = {
+    "response": "👥 Please enter the number of visitors (1-10)\n\nOr type the number of visitors.",
+    "step": "custom_visitors_input",
+    "input_type": "number",
+    "buttons": [
+        {"text": "👤 1", "action": "select_visitors", "value": "1"},
+        {"text": "👥 2", "action": "select_visitors", "value": "2"},
+        {"text": "👥 3", "action": "select_visitors", "value": "3"},
+        {"text": "👥 4", "action": "select_visitors", "value": "4"},
+        {"text": "👥 5", "action": "select_visitors", "value": "5"}
+    ]
+}
+
+# Booking confirmations, filled from the booking's details with str.format_map
+_CHATBOT_CASH_CONFIRMATION = (
+    "✅ **Booking Confirmed!**\n\n🎫 **Booking ID:** #{id}\n📅 **Date:** {date}\n⏰ **Time Slot:** {time_slot}\n"
+    "👥 **Visitors:** {visitors}\n💰 **Amount:** ${amount} USD\n💵 **Payment:** Cash at Museum\n\n"
+    "📝 **Instructions:**\n• Bring exact cash: ${amount}\n• Show Booking ID #{id} at entrance\n"
+    "• Arrive on time for {time_slot}\n\n🎉 Your booking is confirmed!"
+)
+
+_CHATBOT_ONLINE_CONFIRMATION = (
+    "✅ **Booking Created!**\n\n🎫 **Booking ID:** #{id}\n📅 **Date:** {date}\n⏰ **Time Slot:** {time_slot}\n"
+    "👥 **Visitors:** {visitors}\n💰 **Amount:** ${amount} USD\n\n💳 **Complete Payment:**"
+)
+
+_CHATBOT_TEXT_BOOKING_CONFIRMATION = (
+    "✅ Booking Confirmed!\n\n📅 Date: {date}\n⏰ Time Slot: {time_slot}\n👥 Visitors: {visitors}\n"
+    "🎫 Booking ID: {id}\n💰 Amount: ${amount:.2f}\n\nPlease complete payment to confirm your booking!"
+)
+
+def _chatbot_date(value):
+    """Resolve 'today', 'tomorrow' or a YYYY-MM-DD string to a date (ValueError if invalid)"""
+    if value == 'today':
+        return get_today()
+    if value == 'tomorrow':
+        return get_today() + timedelta(days=1)
+    try:
+        return parse_date(value)
+    except ValueError:
+        # Typed dates needn't be zero-padded (2026-12-5)
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+# Dates and visitor counts typed into the chat, and the formats a typed date may use
+CHATBOT_DATE_RE = re.compile(r'\b(\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{1,2}[-/]\d{1,2}[-/]\d{4}|today|tomorrow)\b')
+CHATBOT_VISITORS_RE = re.compile(r'(\d+)')
+CHATBOT_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y')
+
+def _parse_user_date(value):
+    """Resolve 'today', 'tomorrow' or a date in any CHATBOT_DATE_FORMATS; None if it can't be parsed"""
+    if value == 'today':
+        return get_today()
+    if value == 'tomorrow':
+        return get_today() + timedelta(days=1)
+    for fmt in CHATBOT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def _to_int(value, default=1):
+    """int(value), or default when it is missing or not a number"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def _describe_availability(target_date):
+    """Availability for a date as (slots_data, open slot names, per-slot summary text)"""
+    slots_data = get_slot_availability(target_date, get_slot_counts(target_date, AVAILABILITY_PREFETCH_DAYS))
+    available_slots = []
+    lines = [f"📅 Availability for {target_date.strftime('%B %d, %Y')}:\n\n"]
+    for slot_info in slots_data:
+        if slot_info['is_full']:
+            status = "❌ Full"
+        else:
+            status = f"✅ Available ({slot_info['remaining']} spots left)"
+            available_slots.append(slot_info['time_slot'])
+        lines.append(f"• {slot_info['time_slot']}: {status}\n")
+    return slots_data, available_slots, ''.join(lines)
+
+def _chatbot_start_booking(data, booking_data):
+    """Start a fresh chatbot booking at the date step"""
+    if "user_id" not in session:
+        return jsonify({
+            "response": "🔒 You need to be logged in to book tickets.\n\nPlease log in first, then I can help you complete your booking!",
+            "requires_login": True,
+            "buttons": _CHATBOT_LOGIN_BUTTONS
+        })
+
+    # Initialize booking state
+    session['chatbot_booking'] = {
+        'step': 'select_date',
+        'date': None,
+        'time_slot': None,
+        'visitors': None
+    }
+
+    today = get_today()
+    tomorrow = today + timedelta(days=1)
+    next_week = today + timedelta(days=7)
+
+    return jsonify({
+        "response": "🎫 Great! Let's book your ticket step by step!\n\n**Step 1: Select Date**\n\nWhen would you like to visit?",
+        "step": "select_date",
+        "buttons": [
+            {"text": f"📅 Today ({today.strftime('%b %d')})", "action": "select_date", "value": "today"},
+            {"text": f"📅 Tomorrow ({tomorrow.strftime('%b %d')})", "action": "select_date", "value": "tomorrow"},
+            {"text": f"📅 Next Week ({next_week.strftime('%b %d')})", "action": "select_date", "value": next_week.isoformat()},
+            _CHATBOT_CUSTOM_DATE_BUTTON
+        ],
+        "booking_data": session['chatbot_booking']
+    })
+
+def _chatbot_select_date(data, booking_data):
+    """Store the chosen date and offer its open time slots"""
+    selected_date = data.get('date') or booking_data.get('date')
+    if not selected_date:
+        return jsonify({"response": "Please select a date to continue."})
+
+    # Store date in session
+    booking_state = dict(session.get('chatbot_booking', {}))
+    booking_state['date'] = selected_date
+    booking_state['step'] = 'select_time'
+    session['chatbot_booking'] = booking_state
+
+    try:
+        target_date = _chatbot_date(selected_date)
+    except ValueError:
+        target_date = get_today()
+
+    # Get availability
+    slots_data = get_slot_availability(target_date, get_slot_counts(target_date, AVAILABILITY_PREFETCH_DAYS))
+
+    available_slots = [s for s in slots_data if not s['is_full']]
+
+    if not available_slots:
+        return jsonify({
+            "response": f"⚠️ All slots are full for {target_date.strftime('%B %d, %Y')}.\n\nWould you like to try another date?",
+            "step": "select_date",
+            "buttons": [
+                {"text": "📅 Try Tomorrow", "action": "select_date", "value": "tomorrow"},
+                {"text": "📅 Try Next Week", "action": "select_date", "value": (target_date + timedelta(days=7)).isoformat()},
+                _CHATBOT_START_OVER_BUTTON
+            ]
+        })
+
+    # Create time slot buttons
+    slot_buttons = []
+    for slot_info in slots_data:
+        if not slot_info['is_full']:
+            slot_buttons.append({
+                "text": f"{SLOT_LABELS[slot_info['time_slot']]} ({slot_info['remaining']} spots)",
+                "action": "select_time",
+                "value": slot_info['time_slot']
             })
-        
-        # Handle step-by-step booking
-        if step == 'select_date' or action == 'select_date':
-            selected_date = data.get('date') or booking_data.get('date')
-            if not selected_date:
-                return jsonify({"response": "Please select a date to continue."})
-            
-            # Store date in session
-            if 'chatbot_booking' not in session:
-                session['chatbot_booking'] = {}
-            session['chatbot_booking']['date'] = selected_date
-            session['chatbot_booking']['step'] = 'select_time'
-            session.modified = True  # Mark session as modified
-            
-            # Parse date
-            if selected_date == 'today':
-                target_date = date.today()
-            elif selected_date == 'tomorrow':
-                target_date = date.today() + timedelta(days=1)
-            else:
-                try:
-                    target_date = datetime.strptime(selected_date, '%Y-%m-%d').date()
-                except:
-                    target_date = date.today()
-            
-            # Get availability
-            slots_data = []
-            for slot in TIME_SLOTS:
-                booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-                    .filter_by(date=target_date, time_slot=slot).scalar() or 0
-                capacity = SLOT_CAPACITY.get(slot, 20)
-                remaining = max(0, capacity - booked_sum)
-                slots_data.append({
-                    "time_slot": slot,
-                    "remaining": remaining,
-                    "is_full": booked_sum >= capacity,
-                    "capacity": capacity
-                })
-            
-            available_slots = [s for s in slots_data if not s['is_full']]
-            
-            if not available_slots:
-                return jsonify({
-                    "response": f"⚠️ All slots are full for {target_date.strftime('%B %d, %Y')}.\n\nWould you like to try another date?",
-                    "step": "select_date",
-                    "buttons": [
-                        {"text": "📅 Try Tomorrow", "action": "select_date", "value": "tomorrow"},
-                        {"text": "📅 Try Next Week", "action": "select_date", "value": (target_date + timedelta(days=7)).isoformat()},
-                        {"text": "🔄 Start Over", "action": "start_booking"}
-                    ]
-                })
-            
-            # Create time slot buttons
-            slot_buttons = []
-            for slot_info in slots_data:
-                if not slot_info['is_full']:
-                    slot_buttons.append({
-                        "text": f"⏰ {slot_info['time_slot']} ({slot_info['remaining']} spots)",
-                        "action": "select_time",
-                        "value": slot_info['time_slot']
-                    })
-            
+
+    return jsonify({
+        "response": f"✅ Date selected: **{target_date.strftime('%B %d, %Y')}**\n\n**Step 2: Select Time Slot**\n\nAvailable time slots:",
+        "step": "select_time",
+        "buttons": slot_buttons,
+        "booking_data": session['chatbot_booking']
+    })
+
+def _chatbot_select_time(data, booking_data):
+    """Store the chosen time slot and ask for the number of visitors"""
+    selected_slot = data.get('time_slot') or booking_data.get('time_slot')
+    if not selected_slot:
+        return jsonify({"response": "Please select a time slot to continue."})
+
+    booking_state = dict(session.get('chatbot_booking', {}))
+    booking_state['time_slot'] = selected_slot
+    booking_state['step'] = 'select_visitors'
+    session['chatbot_booking'] = booking_state
+
+    return jsonify({
+        "response": f"✅ Time slot selected: **{selected_slot}**\n\n**Step 3: Number of Visitors**\n\nHow many visitors? (Maximum 10 per booking)",
+        "step": "select_visitors",
+        "buttons": _CHATBOT_VISITOR_BUTTONS,
+        "booking_data": session['chatbot_booking']
+    })
+
+def _chatbot_select_visitors(data, booking_data):
+    """Store the visitor count and show the booking summary"""
+    visitors = int(data.get('visitors') or booking_data.get('visitors') or 1)
+    if visitors < 1 or visitors > 10:
+        return jsonify({"response": "Please select between 1 and 10 visitors."})
+
+    booking_state = dict(session.get('chatbot_booking', {}))
+    booking_state['visitors'] = visitors
+    booking_state['step'] = 'confirm_booking'
+    session['chatbot_booking'] = booking_state
+
+    # Calculate amount
+    amount = visitors * TICKET_PRICE
+    booking_date = session['chatbot_booking'].get('date')
+    time_slot = session['chatbot_booking'].get('time_slot')
+
+    # Parse date for display
+    try:
+        display_date = _chatbot_date(booking_date)
+    except ValueError:
+        display_date = get_today()
+
+    return jsonify({
+        "response": f"✅ **Booking Summary**\n\n📅 **Date:** {display_date.strftime('%B %d, %Y')}\n⏰ **Time Slot:** {time_slot}\n👥 **Visitors:** {visitors}\n💰 **Total Amount:** ${amount:.2f} USD\n\n**Step 4: Confirm & Pay**\n\nReady to confirm your booking?",
+        "step": "confirm_booking",
+        "buttons": _CHATBOT_CONFIRM_BUTTONS,
+        "booking_data": session['chatbot_booking'],
+        "amount": amount
+    })
+
+def _chatbot_confirm_and_pay(data, booking_data):
+    """Create the booking for the collected details"""
+    payment_type = data.get('payment_type', 'online')
+
+    # Request booking data takes precedence over what the session collected
+    booking_info = session.get('chatbot_booking', {})
+    if booking_data:
+        booking_info = {**booking_info, **booking_data}
+        session['chatbot_booking'] = booking_info
+
+    date_str = booking_info.get('date') or data.get('date')
+    time_slot = booking_info.get('time_slot') or data.get('time_slot')
+    visitors = _to_int(booking_info.get('visitors') or data.get('visitors'), default=1)
+
+    if not date_str or not time_slot:
+        return jsonify({
+            "response": "❌ Booking information incomplete. Let's start over.\n\nI'll guide you through the booking process step by step!",
+            "action": "start_booking",
+            "buttons": [_CHATBOT_START_NEW_BOOKING_BUTTON]
+        })
+
+    try:
+        target_date = _chatbot_date(date_str)
+
+        # Create booking if the slot still has room
+        payment_fields = {'payment_status': 'cash_pending', 'payment_method': 'cash'} \
+            if payment_type == 'cash' else {'payment_status': 'pending'}
+        booking, available = create_booking_if_available(
+            session["user_id"], target_date, time_slot, visitors,
+            amount=float(visitors * TICKET_PRICE), currency='USD', **payment_fields
+        )
+
+        if booking is None:
             return jsonify({
-                "response": f"✅ Date selected: **{target_date.strftime('%B %d, %Y')}**\n\n**Step 2: Select Time Slot**\n\nAvailable time slots:",
+                "response": f"❌ Sorry! Only {available} spot(s) available for {time_slot}.\n\nWould you like to choose a different time slot?",
                 "step": "select_time",
-                "buttons": slot_buttons,
-                "booking_data": session['chatbot_booking']
+                "buttons": [
+                    {"text": "🔄 Choose Different Slot", "action": "select_date", "value": date_str},
+                    _CHATBOT_START_OVER_BUTTON
+                ]
             })
-        
-        elif step == 'select_time' or action == 'select_time':
-            selected_slot = data.get('time_slot') or booking_data.get('time_slot')
-            if not selected_slot:
-                return jsonify({"response": "Please select a time slot to continue."})
-            
-            session['chatbot_booking']['time_slot'] = selected_slot
-            session['chatbot_booking']['step'] = 'select_visitors'
-            session.modified = True  # Mark session as modified
-            
+
+        # Clear booking session
+        session.pop('chatbot_booking', None)
+
+        details = {
+            'id': booking.id,
+            'date': target_date.strftime('%B %d, %Y'),
+            'time_slot': time_slot,
+            'visitors': visitors,
+            'amount': f"{booking.amount:.2f}",
+        }
+        payment_url = f"/payment/{booking.id}"
+
+        if payment_type == 'cash':
             return jsonify({
-                "response": f"✅ Time slot selected: **{selected_slot}**\n\n**Step 3: Number of Visitors**\n\nHow many visitors? (Maximum 10 per booking)",
-                "step": "select_visitors",
+                "response": _CHATBOT_CASH_CONFIRMATION.format_map(details),
+                "success": True,
+                "booking": booking.to_dict(),
+                "payment_type": "cash",
                 "buttons": [
-                    {"text": "👤 1 Visitor", "action": "select_visitors", "value": "1"},
-                    {"text": "👥 2 Visitors", "action": "select_visitors", "value": "2"},
-                    {"text": "👥 3 Visitors", "action": "select_visitors", "value": "3"},
-                    {"text": "👥 4 Visitors", "action": "select_visitors", "value": "4"},
-                    {"text": "👥 5+ Visitors", "action": "custom_visitors"}
-                ],
-                "booking_data": session['chatbot_booking']
+                    {"text": f"💳 Pay Online Now (${details['amount']})", "action": "pay_online", "booking_id": booking.id, "url": payment_url},
+                    _CHATBOT_VIEW_BOOKINGS_BUTTON
+                ]
             })
-        
-        elif step == 'select_visitors' or action == 'select_visitors':
-            visitors = int(data.get('visitors') or booking_data.get('visitors') or 1)
-            if visitors < 1 or visitors > 10:
-                return jsonify({"response": "Please select between 1 and 10 visitors."})
-            
-            session['chatbot_booking']['visitors'] = visitors
-            session['chatbot_booking']['step'] = 'confirm_booking'
-            session.modified = True  # Mark session as modified
-            
-            # Calculate amount
-            amount = visitors * TICKET_PRICE
-            booking_date = session['chatbot_booking'].get('date')
-            time_slot = session['chatbot_booking'].get('time_slot')
-            
-            # Parse date for display
-            if booking_date == 'today':
-                display_date = date.today()
-            elif booking_date == 'tomorrow':
-                display_date = date.today() + timedelta(days=1)
-            else:
-                try:
-                    display_date = datetime.strptime(booking_date, '%Y-%m-%d').date()
-                except:
-                    display_date = date.today()
-            
+        else:
+            # For online payment, return payment link
             return jsonify({
-                "response": f"✅ **Booking Summary**\n\n📅 **Date:** {display_date.strftime('%B %d, %Y')}\n⏰ **Time Slot:** {time_slot}\n👥 **Visitors:** {visitors}\n💰 **Total Amount:** ${amount:.2f} USD\n\n**Step 4: Confirm & Pay**\n\nReady to confirm your booking?",
-                "step": "confirm_booking",
+                "response": _CHATBOT_ONLINE_CONFIRMATION.format_map(details),
+                "success": True,
+                "booking": booking.to_dict(),
+                "payment_type": "online",
+                "payment_required": True,
                 "buttons": [
-                    {"text": "💳 Pay Online Now", "action": "confirm_and_pay", "payment_type": "online"},
-                    {"text": "💵 Pay Later (Cash)", "action": "confirm_and_pay", "payment_type": "cash"},
-                    {"text": "✏️ Edit Booking", "action": "start_booking"}
-                ],
-                "booking_data": session['chatbot_booking'],
-                "amount": amount
+                    {"text": f"💳 Pay Now (${details['amount']})", "action": "pay_online", "booking_id": booking.id, "url": payment_url},
+                    {"text": "💵 Pay Later (Cash)", "action": "change_to_cash", "booking_id": booking.id},
+                    _CHATBOT_VIEW_BOOKINGS_BUTTON
+                ]
             })
-        
-        elif action == 'confirm_and_pay':
-            payment_type = data.get('payment_type', 'online')
-            
-            # Try to get booking data from multiple sources
-            booking_info = session.get('chatbot_booking', {})
-            booking_data_from_request = data.get('booking_data', {})
-            
-            # Merge request data with session data (request data takes precedence)
-            if booking_data_from_request:
-                # Update session with request data
-                if 'chatbot_booking' not in session:
-                    session['chatbot_booking'] = {}
-                session['chatbot_booking'].update(booking_data_from_request)
-                booking_info = session['chatbot_booking']
-                session.modified = True  # Mark session as modified
-            
-            # Get values with fallbacks
-            date_str = booking_info.get('date') or booking_data_from_request.get('date') or data.get('date')
-            time_slot = booking_info.get('time_slot') or booking_data_from_request.get('time_slot') or data.get('time_slot')
-            visitors_value = booking_info.get('visitors') or booking_data_from_request.get('visitors') or data.get('visitors')
-            
-            # Handle None case properly for visitors
-            if visitors_value is None:
-                visitors = 1
-            else:
-                try:
-                    visitors = int(visitors_value)
-                except (ValueError, TypeError):
-                    visitors = 1
-            
-            # Final check - if still missing, return error with helpful message
-            if not date_str or not time_slot:
-                # Try to restore from session one more time
-                booking_info = session.get('chatbot_booking', {})
-                if booking_info:
-                    date_str = booking_info.get('date') or date_str
-                    time_slot = booking_info.get('time_slot') or time_slot
-                    visitors_value = booking_info.get('visitors')
-                    if visitors_value:
-                        try:
-                            visitors = int(visitors_value)
-                        except:
-                            visitors = 1
-                
-                if not date_str or not time_slot:
-                    return jsonify({
-                        "response": "❌ Booking information incomplete. Let's start over.\n\nI'll guide you through the booking process step by step!",
-                        "action": "start_booking",
-                        "buttons": [
-                            {"text": "🎫 Start New Booking", "action": "start_booking"}
-                        ]
-                    })
-            
-            try:
-                # Parse date
-                if date_str == 'today':
-                    target_date = date.today()
-                elif date_str == 'tomorrow':
-                    target_date = date.today() + timedelta(days=1)
-                else:
-                    target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                
-                # Check availability again
-                booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-                    .filter_by(date=target_date, time_slot=time_slot).scalar() or 0
-                capacity = SLOT_CAPACITY.get(time_slot, 20)
-                
-                if booked_sum + visitors > capacity:
-                    available = max(0, capacity - booked_sum)
-                    return jsonify({
-                        "response": f"❌ Sorry! Only {available} spot(s) available for {time_slot}.\n\nWould you like to choose a different time slot?",
-                        "step": "select_time",
-                        "buttons": [
-                            {"text": "🔄 Choose Different Slot", "action": "select_date", "value": date_str},
-                            {"text": "🔄 Start Over", "action": "start_booking"}
-                        ]
-                    })
-                
-                # Create booking
-                booking = Booking(user_id=session["user_id"], date=target_date, time_slot=time_slot, visitors=visitors)
-                booking.amount = booking.calculate_amount(TICKET_PRICE)
-                booking.currency = 'USD'
-                
-                if payment_type == 'cash':
-                    booking.payment_status = 'cash_pending'
-                    booking.payment_method = 'cash'
-                else:
-                    booking.payment_status = 'pending'
-                
-                db.session.add(booking)
-                db.session.commit()
-                
-                # Clear booking session
-                session.pop('chatbot_booking', None)
-                
-                if payment_type == 'cash':
-                    return jsonify({
-                        "response": f"✅ **Booking Confirmed!**\n\n🎫 **Booking ID:** #{booking.id}\n📅 **Date:** {target_date.strftime('%B %d, %Y')}\n⏰ **Time Slot:** {time_slot}\n👥 **Visitors:** {visitors}\n💰 **Amount:** ${booking.amount:.2f} USD\n💵 **Payment:** Cash at Museum\n\n📝 **Instructions:**\n• Bring exact cash: ${booking.amount:.2f}\n• Show Booking ID #{booking.id} at entrance\n• Arrive on time for {time_slot}\n\n🎉 Your booking is confirmed!",
-                        "success": True,
-                        "booking": booking.to_dict(),
-                        "payment_type": "cash",
-                        "buttons": [
-                            {"text": "💳 Pay Online Now ($" + f"{booking.amount:.2f})", "action": "pay_online", "booking_id": booking.id, "url": f"/payment/{booking.id}"},
-                            {"text": "📋 View All Bookings", "action": "view_bookings", "url": "/my_bookings"}
-                        ]
-                    })
-                else:
-                    # For online payment, return payment link
-                    return jsonify({
-                        "response": f"✅ **Booking Created!**\n\n🎫 **Booking ID:** #{booking.id}\n📅 **Date:** {target_date.strftime('%B %d, %Y')}\n⏰ **Time Slot:** {time_slot}\n👥 **Visitors:** {visitors}\n💰 **Amount:** ${booking.amount:.2f} USD\n\n💳 **Complete Payment:**",
-                        "success": True,
-                        "booking": booking.to_dict(),
-                        "payment_type": "online",
-                        "payment_required": True,
-                        "buttons": [
-                            {"text": "💳 Pay Now ($" + f"{booking.amount:.2f})", "action": "pay_online", "booking_id": booking.id, "url": f"/payment/{booking.id}"},
-                            {"text": "💵 Pay Later (Cash)", "action": "change_to_cash", "booking_id": booking.id},
-                            {"text": "📋 View All Bookings", "action": "view_bookings", "url": "/my_bookings"}
-                        ]
-                    })
-            except Exception as e:
-                return jsonify({"response": f"❌ Error creating booking: {str(e)}\n\nLet's try again!", "action": "start_booking"})
-        
-        elif action == 'change_to_cash':
-            booking_id = data.get('booking_id')
-            if booking_id:
-                booking = Booking.query.get(booking_id)
-                if booking and booking.user_id == session.get('user_id'):
-                    booking.payment_status = 'cash_pending'
-                    booking.payment_method = 'cash'
-                    db.session.commit()
-                    return jsonify({
-                        "response": f"✅ **Payment method changed to Cash!**\n\n💵 You can pay ${booking.amount:.2f} USD in cash when you visit.\n\n📝 **Instructions:**\n• Bring exact cash: ${booking.amount:.2f}\n• Show Booking ID #{booking.id} at entrance\n• Arrive on time for {booking.time_slot}\n\n🎉 Your booking is confirmed!",
-                        "success": True,
-                        "booking": booking.to_dict()
+    except Exception as e:
+        return jsonify({"response": f"❌ Error creating booking: {str(e)}\n\nLet's try again!", "action": "start_booking"})
+
+def _chatbot_change_to_cash(data, booking_data):
+    """Switch one of the user's bookings to cash payment"""
+    booking_id = data.get('booking_id')
+    if booking_id:
+        booking = get_user_booking(booking_id)
+        if booking:
+            booking.payment_status = 'cash_pending'
+            booking.payment_method = 'cash'
+            # Build the reply before committing so the expired booking isn't reloaded
+            response = jsonify({
+                "response": f"✅ **Payment method changed to Cash!**\n\n💵 You can pay ${booking.amount:.2f} USD in cash when you visit.\n\n📝 **Instructions:**\n• Bring exact cash: ${booking.amount:.2f}\n• Show Booking ID #{booking.id} at entrance\n• Arrive on time for {booking.time_slot}\n\n🎉 Your booking is confirmed!",
+                "success": True,
+                "booking": booking.to_dict()
+            })
+            db.session.commit()
+            return response
+
+def _chatbot_custom_date(data, booking_data):
+    """Ask the user to type a date"""
+    return jsonify(_CHATBOT_CUSTOM_DATE_PROMPT)
+
+def _chatbot_custom_visitors(data, booking_data):
+    """Ask the user to type the number of visitors"""
+    return jsonify(_CHATBOT_CUSTOM_VISITORS_PROMPT)
+
+def _chatbot_book_from_availability(data, booking_data):
+    """Start a booking with the date and slot picked from availability"""
+    # Start booking with pre-selected date and time slot
+    date_str = data.get('date')
+    time_slot = data.get('time_slot')
+
+    if "user_id" not in session:
+        return jsonify({
+            "response": "🔒 You need to be logged in to book tickets.",
+            "requires_login": True,
+            "buttons": _CHATBOT_LOGIN_BUTTONS
+        })
+
+    # Initialize booking with pre-selected values
+    session['chatbot_booking'] = {
+        'step': 'select_visitors',
+        'date': date_str,
+        'time_slot': time_slot,
+        'visitors': None
+    }
+
+    return jsonify({
+        "response": f"✅ Great choice! **{time_slot}** on {date_str}\n\n**Step 3: Number of Visitors**\n\nHow many visitors? (Maximum 10 per booking)",
+        "step": "select_visitors",
+        "buttons": _CHATBOT_VISITOR_BUTTONS,
+        "booking_data": session['chatbot_booking']
+    })
+
+def _chatbot_check_availability(data, booking_data):
+    """Show slot availability for a date"""
+    date_str = data.get('date')
+    if not date_str:
+        return jsonify({"response": "Please provide a date to check availability."})
+
+    try:
+        target_date = _parse_user_date(date_str)
+        if target_date is None:
+            return jsonify({"response": "Invalid date format. Please use YYYY-MM-DD format."})
+
+        slots_data, available_slots, response = _describe_availability(target_date)
+
+        if available_slots:
+            response += f"\n💡 **Available slots:** {', '.join(available_slots)}\n\nWould you like to book one of these slots?"
+
+            # Create buttons for available slots
+            slot_buttons = []
+            for slot_info in slots_data:
+                if not slot_info['is_full']:
+                    slot_buttons.append({
+                        "text": f"{SLOT_LABELS[slot_info['time_slot']]} ({slot_info['remaining']} spots)",
+                        "action": "book_from_availability",
+                        "time_slot": slot_info['time_slot'],
+                        "date": date_str
                     })
-        
-        elif action == 'custom_date':
+
+            slot_buttons.append(_CHATBOT_START_NEW_BOOKING_BUTTON)
+
             return jsonify({
-                "response": "📅 Please enter the date in YYYY-MM-DD format (e.g., 2024-12-25)\n\nOr type the date you'd like to visit.",
-                "step": "custom_date_input",
-                "input_type": "date"
+                "response": response, 
+                "slots": slots_data, 
+                "date": date_str,
+                "buttons": slot_buttons
             })
-        
-        elif action == 'custom_visitors':
+        else:
+            response += "\n⚠️ All slots are full for this date. Please try another date."
             return jsonify({
-                "response": "👥 Please enter the number of visitors (1-10)\n\nOr type the number of visitors.",
-                "step": "custom_visitors_input",
-                "input_type": "number",
+                "response": response,
                 "buttons": [
-                    {"text": "👤 1", "action": "select_visitors", "value": "1"},
-                    {"text": "👥 2", "action": "select_visitors", "value": "2"},
-                    {"text": "👥 3", "action": "select_visitors", "value": "3"},
-                    {"text": "👥 4", "action": "select_visitors", "value": "4"},
-                    {"text": "👥 5", "action": "select_visitors", "value": "5"}
+                    {"text": "📅 Try Tomorrow", "action": "check_availability", "date": "tomorrow"},
+                    {"text": "📅 Try Next Week", "action": "check_availability", "date": (target_date + timedelta(days=7)).isoformat()},
+                    {"text": "🔄 Start Booking", "action": "start_booking"}
                 ]
             })
-        
-        elif action == 'book_from_availability':
-            # Start booking with pre-selected date and time slot
-            date_str = data.get('date')
-            time_slot = data.get('time_slot')
-            
-            if "user_id" not in session:
-                return jsonify({
-                    "response": "🔒 You need to be logged in to book tickets.",
-                    "requires_login": True,
-                    "buttons": [{"text": "🔗 Log In", "action": "login", "url": "/login"}]
-                })
-            
-            # Initialize booking with pre-selected values
-            session['chatbot_booking'] = {
-                'step': 'select_visitors',
-                'date': date_str,
-                'time_slot': time_slot,
-                'visitors': None
-            }
-            session.modified = True  # Mark session as modified
-            
+    except Exception as e:
+        return jsonify({"response": f"Error checking availability: {str(e)}"})
+
+def _chatbot_book_ticket(data, booking_data):
+    """Book a ticket in one step from date, slot and visitors"""
+    # Check if user is logged in
+    if "user_id" not in session:
+        return jsonify({
+            "response": "🔒 You need to be logged in to book tickets.\n\nPlease log in first, then I can help you complete your booking!",
+            "requires_login": True
+        })
+
+    date_str = data.get('date')
+    time_slot = data.get('time_slot')
+    visitors = int(data.get('visitors', 1))
+
+    if not date_str or not time_slot:
+        return jsonify({"response": "Please provide date, time slot, and number of visitors to complete booking."})
+
+    try:
+        target_date = _parse_user_date(date_str)
+        if target_date is None:
+            return jsonify({"response": "Invalid date format. Please use YYYY-MM-DD format."})
+
+        if time_slot not in TIME_SLOTS_SET:
+            return jsonify({"response": f"Invalid time slot. Available slots: {', '.join(TIME_SLOTS)}"})
+
+        # Create booking (with its amount) if the slot still has room
+        booking, available = create_booking_if_available(
+            session["user_id"], target_date, time_slot, visitors,
+            amount=float(visitors * TICKET_PRICE), currency='USD'
+        )
+
+        if booking is None:
             return jsonify({
-                "response": f"✅ Great choice! **{time_slot}** on {date_str}\n\n**Step 3: Number of Visitors**\n\nHow many visitors? (Maximum 10 per booking)",
-                "step": "select_visitors",
-                "buttons": [
-                    {"text": "👤 1 Visitor", "action": "select_visitors", "value": "1"},
-                    {"text": "👥 2 Visitors", "action": "select_visitors", "value": "2"},
-                    {"text": "👥 3 Visitors", "action": "select_visitors", "value": "3"},
-                    {"text": "👥 4 Visitors", "action": "select_visitors", "value": "4"},
-                    {"text": "👥 5+ Visitors", "action": "custom_visitors"}
-                ],
-                "booking_data": session['chatbot_booking']
+                "response": f"❌ Sorry! Only {available} spot(s) available for {time_slot} on {target_date.strftime('%B %d, %Y')}.\n\nPlease choose a different time slot or reduce the number of visitors."
             })
+
+        response = _CHATBOT_TEXT_BOOKING_CONFIRMATION.format(
+            date=target_date.strftime('%B %d, %Y'), time_slot=time_slot, visitors=visitors,
+            id=booking.id, amount=booking.amount
+        )
+
+        return jsonify({
+            "response": response,
+            "booking": booking.to_dict(),
+            "success": True,
+            "payment_required": True,
+            "payment_url": f"/payment/{booking.id}"
+        })
+    except Exception as e:
+        return jsonify({"response": f"Error creating booking: {str(e)}"})
+
+# Booking steps are matched on the request's step or action, everything else on its action
+_CHATBOT_STEPS = {
+    'select_date': _chatbot_select_date,
+    'select_time': _chatbot_select_time,
+    'select_visitors': _chatbot_select_visitors,
+}
+
+_CHATBOT_ACTIONS = {
+    **_CHATBOT_STEPS,
+    'start_booking': _chatbot_start_booking,
+    'confirm_and_pay': _chatbot_confirm_and_pay,
+    'change_to_cash': _chatbot_change_to_cash,
+    'custom_date': _chatbot_custom_date,
+    'custom_visitors': _chatbot_custom_visitors,
+    'book_from_availability': _chatbot_book_from_availability,
+    'check_availability': _chatbot_check_availability,
+    'book_ticket': _chatbot_book_ticket,
+}
+
+def _chatbot_handler(step, action):
+    """Pick the handler in the original order: start_booking, then booking steps (by step or action), then actions"""
+    if action == 'start_booking':
+        return _chatbot_start_booking
+    for name, handler in _CHATBOT_STEPS.items():
+        if step == name or action == name:
+            return handler
+    return _CHATBOT_ACTIONS.get(action)
+
+@app.route('/chatbot', methods=['GET', 'POST'])
+@login_required
+def chatbot():
+    if request.method == 'POST':
+        data = request.get_json()
+        user_message = data.get('message', '').strip()
+        action = data.get('action')  # For booking actions
+        step = data.get('step')  # For step-by-step booking
+        booking_data = data.get('booking_data', {})  # Store booking data
         
-        # Handle booking actions from chatbot
-        if action == 'check_availability':
-            date_str = data.get('date')
-            if not date_str:
-                return jsonify({"response": "Please provide a date to check availability."})
-            
-            try:
-                if date_str == 'today':
-                    target_date = date.today()
-                elif date_str == 'tomorrow':
-                    target_date = date.today() + timedelta(days=1)
-                else:
-                    for fmt in ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']:
-                        try:
-                            target_date = datetime.strptime(date_str, fmt).date()
-                            break
-                        except:
-                            continue
-                    else:
-                        return jsonify({"response": "Invalid date format. Please use YYYY-MM-DD format."})
-                
-                slots_data = []
-                for slot in TIME_SLOTS:
-                    booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-                        .filter_by(date=target_date, time_slot=slot).scalar() or 0
-                    capacity = SLOT_CAPACITY.get(slot, 20)
-                    remaining = max(0, capacity - booked_sum)
-                    slots_data.append({
-                        "time_slot": slot,
-                        "remaining": remaining,
-                        "is_full": booked_sum >= capacity,
-                        "capacity": capacity
-                    })
-                
-                response = f"📅 Availability for {target_date.strftime('%B %d, %Y')}:\n\n"
-                available_slots = []
-                for slot_info in slots_data:
-                    if not slot_info['is_full']:
-                        status = f"✅ Available ({slot_info['remaining']} spots left)"
-                        available_slots.append(slot_info['time_slot'])
-                    else:
-                        status = "❌ Full"
-                    response += f"• {slot_info['time_slot']}: {status}\n"
-                
-                if available_slots:
-                    response += f"\n💡 **Available slots:** {', '.join(available_slots)}\n\nWould you like to book one of these slots?"
-                    
-                    # Create buttons for available slots
-                    slot_buttons = []
-                    for slot_info in slots_data:
-                        if not slot_info['is_full']:
-                            slot_buttons.append({
-                                "text": f"⏰ {slot_info['time_slot']} ({slot_info['remaining']} spots)",
-                                "action": "book_from_availability",
-                                "time_slot": slot_info['time_slot'],
-                                "date": date_str
-                            })
-                    
-                    slot_buttons.append({"text": "🎫 Start New Booking", "action": "start_booking"})
-                    
-                    return jsonify({
-                        "response": response, 
-                        "slots": slots_data, 
-                        "date": date_str,
-                        "buttons": slot_buttons
-                    })
-                else:
-                    response += "\n⚠️ All slots are full for this date. Please try another date."
-                    return jsonify({
-                        "response": response,
-                        "buttons": [
-                            {"text": "📅 Try Tomorrow", "action": "check_availability", "date": "tomorrow"},
-                            {"text": "📅 Try Next Week", "action": "check_availability", "date": (target_date + timedelta(days=7)).isoformat()},
-                            {"text": "🔄 Start Booking", "action": "start_booking"}
-                        ]
-                    })
-            except Exception as e:
-                return jsonify({"response": f"Error checking availability: {str(e)}"})
+        if not user_message and not action:
+            return jsonify({"response": "Please ask me a question! I can help with booking tickets, exhibits, and more."})
         
-        elif action == 'book_ticket':
-            # Check if user is logged in
-            if "user_id" not in session:
-                return jsonify({
-                    "response": "🔒 You need to be logged in to book tickets.\n\nPlease log in first, then I can help you complete your booking!",
-                    "requires_login": True
-                })
-            
-            date_str = data.get('date')
-            time_slot = data.get('time_slot')
-            visitors = int(data.get('visitors', 1))
-            
-            if not date_str or not time_slot:
-                return jsonify({"response": "Please provide date, time slot, and number of visitors to complete booking."})
-            
-            try:
-                if date_str == 'today':
-                    target_date = date.today()
-                elif date_str == 'tomorrow':
-                    target_date = date.today() + timedelta(days=1)
-                else:
-                    for fmt in ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']:
-                        try:
-                            target_date = datetime.strptime(date_str, fmt).date()
-                            break
-                        except:
-                            continue
-                    else:
-                        return jsonify({"response": "Invalid date format. Please use YYYY-MM-DD format."})
-                
-                if time_slot not in TIME_SLOTS:
-                    return jsonify({"response": f"Invalid time slot. Available slots: {', '.join(TIME_SLOTS)}"})
-                
-                # Check availability
-                booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-                    .filter_by(date=target_date, time_slot=time_slot).scalar() or 0
-                capacity = SLOT_CAPACITY.get(time_slot, 20)
-                
-                if booked_sum + visitors > capacity:
-                    available = max(0, capacity - booked_sum)
-                    return jsonify({
-                        "response": f"❌ Sorry! Only {available} spot(s) available for {time_slot} on {target_date.strftime('%B %d, %Y')}.\n\nPlease choose a different time slot or reduce the number of visitors."
-                    })
-                
-                # Create booking
-                booking = Booking(user_id=session["user_id"], date=target_date, time_slot=time_slot, visitors=visitors)
-                db.session.add(booking)
-                db.session.commit()
-                
-                # Calculate and set amount
-                booking.amount = booking.calculate_amount(TICKET_PRICE)
-                booking.currency = 'USD'
-                db.session.commit()
-                
-                response = f"✅ Booking Confirmed!\n\n"
-                response += f"📅 Date: {target_date.strftime('%B %d, %Y')}\n"
-                response += f"⏰ Time Slot: {time_slot}\n"
-                response += f"👥 Visitors: {visitors}\n"
-                response += f"🎫 Booking ID: {booking.id}\n"
-                response += f"💰 Amount: ${booking.amount:.2f}\n\n"
-                response += "Please complete payment to confirm your booking!"
-                
-                return jsonify({
-                    "response": response,
-                    "booking": booking.to_dict(),
-                    "success": True,
-                    "payment_required": True,
-                    "payment_url": f"/payment/{booking.id}"
-                })
-            except Exception as e:
-                return jsonify({"response": f"Error creating booking: {str(e)}"})
+        handler = _chatbot_handler(step, action)
+        if handler:
+            response = handler(data, booking_data)
+            if response is not None:
+                return response
         
         # Handle custom date/visitor input
         booking_state = session.get('chatbot_booking', {})
@@ -1114,13 +1279,12 @@ def chatbot():
         
         if current_step == 'custom_date_input' and user_message:
             # Try to parse date from message
-            date_pattern = r'\b(\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{1,2}[-/]\d{1,2}[-/]\d{4}|today|tomorrow)\b'
-            date_match = re.search(date_pattern, user_message.lower())
-            if date_match:
-                date_value = date_match.group(1).lower()
+            date_match = CHATBOT_DATE_RE.search(user_message.lower())
+            typed_date = _parse_user_date(date_match.group(1)) if date_match else None
+            if typed_date:
                 return jsonify({
                     "action": "select_date",
-                    "date": date_value,
+                    "date": typed_date.isoformat(),
                     "step": "select_date",
                     "booking_data": booking_state
                 })
@@ -1128,16 +1292,12 @@ def chatbot():
                 return jsonify({
                     "response": "I couldn't understand that date. Please use format YYYY-MM-DD (e.g., 2024-12-25) or say 'today'/'tomorrow'.",
                     "step": "custom_date_input",
-                    "buttons": [
-                        {"text": "📅 Today", "action": "select_date", "value": "today"},
-                        {"text": "📅 Tomorrow", "action": "select_date", "value": "tomorrow"},
-                        {"text": "🔄 Start Over", "action": "start_booking"}
-                    ]
+                    "buttons": _CHATBOT_DATE_RETRY_BUTTONS
                 })
         
         elif current_step == 'custom_visitors_input' and user_message:
             # Try to extract number
-            visitor_match = re.search(r'(\d+)', user_message)
+            visitor_match = CHATBOT_VISITORS_RE.search(user_message)
             if visitor_match:
                 visitors = int(visitor_match.group(1))
                 if 1 <= visitors <= 10:
@@ -1172,63 +1332,29 @@ def chatbot():
         # Regular chatbot responses
         if user_message:
             # Check if user is asking about availability for a specific date
-            date_pattern = r'\b(\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{1,2}[-/]\d{1,2}[-/]\d{4}|today|tomorrow)\b'
-            date_match = re.search(date_pattern, user_message.lower())
+            date_match = CHATBOT_DATE_RE.search(user_message.lower())
             
             if date_match:
                 try:
-                    date_str = date_match.group(1)
-                    if date_str == 'today':
-                        target_date = date.today()
-                    elif date_str == 'tomorrow':
-                        target_date = date.today() + timedelta(days=1)
-                    else:
-                        # Try to parse the date
-                        for fmt in ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']:
-                            try:
-                                target_date = datetime.strptime(date_str, fmt).date()
-                                break
-                            except:
-                                continue
-                        else:
-                            target_date = None
+                    target_date = _parse_user_date(date_match.group(1))
                     
                     if target_date:
                         # Get availability for that date
-                        slots_data = []
-                        for slot in TIME_SLOTS:
-                            booked_sum = db.session.query(db.func.coalesce(db.func.sum(Booking.visitors), 0))\
-                                .filter_by(date=target_date, time_slot=slot).scalar() or 0
-                            capacity = SLOT_CAPACITY.get(slot, 20)
-                            remaining = max(0, capacity - booked_sum)
-                            slots_data.append({
-                                "time_slot": slot,
-                                "remaining": remaining,
-                                "is_full": booked_sum >= capacity
-                            })
-                        
-                        response = f"📅 Availability for {target_date.strftime('%B %d, %Y')}:\n\n"
-                        available_slots = []
-                        for slot_info in slots_data:
-                            if not slot_info['is_full']:
-                                status = f"✅ Available ({slot_info['remaining']} spots left)"
-                                available_slots.append(slot_info['time_slot'])
-                            else:
-                                status = "❌ Full"
-                            response += f"• {slot_info['time_slot']}: {status}\n"
+                        _, available_slots, response = _describe_availability(target_date)
                         
                         if available_slots:
-                            response += f"\n💡 I can help you book! Just tell me:\n"
-                            response += "1. Which time slot? (e.g., '9AM–10AM')\n"
-                            response += "2. How many visitors?\n\n"
                             if "user_id" not in session:
-                                response += "⚠️ Note: You'll need to log in first to complete the booking."
+                                closing = "⚠️ Note: You'll need to log in first to complete the booking."
                             else:
-                                response += "I'll create the booking for you right away!"
+                                closing = "I'll create the booking for you right away!"
+                            bot_response = (
+                                f"{response}\n💡 I can help you book! Just tell me:\n"
+                                "1. Which time slot? (e.g., '9AM–10AM')\n"
+                                "2. How many visitors?\n\n"
+                                f"{closing}"
+                            )
                         else:
-                            response += "\n⚠️ All slots are full for this date. Please try another date."
-                        
-                        bot_response = response
+                            bot_response = response + "\n⚠️ All slots are full for this date. Please try another date."
                     else:
                         bot_response = get_chatbot_response(user_message)
                 except Exception as e:
@@ -1242,9 +1368,14 @@ def chatbot():
     else:
         return render_template('chatbot.html')
 
-@app.teardown_appcontext
-def shutdown_session(exception=None):
-    db.session.remove()
+@app.after_request
+def warn_on_query_count(response):
+    """Flag requests that issue more queries than expected (dev only)"""
+    if app.config['SQLALCHEMY_RECORD_QUERIES']:
+        query_count = len(get_recorded_queries())
+        if query_count > app.config['QUERY_COUNT_WARNING']:
+            print(f"Warning: {request.method} {request.path} issued {query_count} queries")
+    return response
 
 # WebSocket Events
 @socketio.on('connect')
@@ -1298,6 +1429,9 @@ def handle_chat_message(data):
     channel = get_website_channel()
     if session_id:
         session_obj = channel.get_session(session_id=session_id)
+        if not session_obj:
+            emit('error', {'message': 'Session not found'})
+            return
     else:
         session_obj = channel.create_session(
             user_id=user_id,
@@ -1306,18 +1440,20 @@ def handle_chat_message(data):
         session_id = session_obj.session_id
         join_room(session_id)
     
-    # Save incoming message
+    # Save incoming message (reusing the session loaded above)
     result = channel.receive_message(
         {'message': message},
         user_id=user_id,
-        session_id=session_id
+        session_id=session_id,
+        session=session_obj
     )
     
     # Get chatbot response
     bot_response = get_chatbot_response(message)
     
-    # Save bot response
+    # Save bot response; the session and both messages go out in one commit
     channel.send_message(session_obj, bot_response)
+    db.session.commit()
     
     # Emit response to room
     emit('bot_response', {
@@ -1326,28 +1462,70 @@ def handle_chat_message(data):
     }, room=session_id)
 
 # Error handler for escalations (only for unhandled exceptions)
+ESCALATION_BATCH_SIZE = 50
+ESCALATION_FLUSH_INTERVAL = 1.0  # seconds
+_escalation_queue = queue.Queue()
+
+_escalation_writer = None
+_escalation_writer_lock = threading.Lock()
+
+def _write_escalations(batch):
+    """Insert a batch of escalations in their own app context"""
+    try:
+        with app.app_context():
+            db.session.add_all([Escalation(**fields) for fields in batch])
+            db.session.commit()
+    except Exception as db_error:
+        # Don't let a failed write stop the drainer
+        print(f"Could not create escalations: {db_error}")
+
+def _drain_escalations():
+    """Write queued error escalations in batches, off the request thread"""
+    while True:
+        batch = [_escalation_queue.get()]
+        deadline = time.monotonic() + ESCALATION_FLUSH_INTERVAL
+        while len(batch) < ESCALATION_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_escalation_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _write_escalations(batch)
+
+def _enqueue_escalation(fields):
+    """Hand an escalation to this process's background writer, starting it on first use"""
+    global _escalation_writer
+    if os.getenv('VERCEL'):
+        # Serverless instances can be frozen once the response is sent; write it now
+        _write_escalations([fields])
+        return
+    # Started lazily rather than at import so each (pre)forked worker runs its own writer
+    if _escalation_writer is None or not _escalation_writer.is_alive():
+        with _escalation_writer_lock:
+            if _escalation_writer is None or not _escalation_writer.is_alive():
+                _escalation_writer = threading.Thread(
+                    target=_drain_escalations, name='escalation-writer', daemon=True
+                )
+                _escalation_writer.start()
+    _escalation_queue.put_nowait(fields)
+
 @app.errorhandler(500)
 def handle_500_error(e):
     """Handle 500 errors"""
     error_code = type(e).__name__ if hasattr(e, '__class__') else 'UnknownError'
     error_message = str(e) if e else 'Unknown error'
     
-    # Only log critical errors, don't block the response
-    try:
-        with app.app_context():
-            escalation = Escalation(
-                type='error',
-                severity='high',
-                status='open',
-                title=f"Error: {error_code}",
-                description=error_message[:500],  # Limit description length
-                error_code=error_code
-            )
-            db.session.add(escalation)
-            db.session.commit()
-    except Exception as db_error:
-        # Don't fail if escalation creation fails
-        print(f"Could not create escalation: {db_error}")
+    # Escalation is written by the background drainer (inline on Vercel), don't block the response
+    _enqueue_escalation({
+        'type': 'error',
+        'severity': 'high',
+        'status': 'open',
+        'title': f"Error: {error_code}",
+        'description': error_message[:500],  # Limit description length
+        'error_code': error_code
+    })
     
     # Return appropriate response based on request type
     if request.path.startswith('/api/'):
@@ -1374,9 +1552,9 @@ if __name__ == '__main__':
     print(f"📡 Main Server:     http://127.0.0.1:5001")
     
     try:
-        # Use app.run for better compatibility, socketio will work with it
+        # eventlet is installed, so socketio.run serves with eventlet's WSGI server rather than werkzeug's
         print("✅ Starting Flask-SocketIO server...\n")
-        socketio.run(app, debug=True, host='127.0.0.1', port=5001, allow_unsafe_werkzeug=True, use_reloader=False)
+        socketio.run(app, debug=False, host='127.0.0.1', port=5001)
     except KeyboardInterrupt:
         print("\n\n🛑 Server stopped by user. Goodbye!")
         import sys
@@ -2,7 +2,7 @@
 from .base import BaseChannel
 from .website import WebsiteChannel
 from .instagram import InstagramChannel
-from .voice import VoiceChannel
+from .voice import VoiceChannel, AudioTooLargeError
 
-__all__ = ['BaseChannel', 'WebsiteChannel', 'InstagramChannel', 'VoiceChannel']
+__all__ = ['BaseChannel', 'WebsiteChannel', 'InstagramChannel', 'VoiceChannel', 'AudioTooLargeError']
 
@@ -4,36 +4,61 @@ Base channel class for multi-channel communication
 from abc import ABC, abstractmethod
 from datetime import datetime
 from models import db, ConversationSession, ConversationMessage, Channel
+from sqlalchemy.orm import selectinload
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
 import uuid
 
+def _build_http_session():
+    """HTTP session shared by the channels so outbound calls reuse pooled keep-alive connections"""
+    session = requests.Session()
+    # Retry covers connection errors and idempotent methods only, so a DM POST is never sent twice
+    adapter = HTTPAdapter(pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+http_session = _build_http_session()
+
 class BaseChannel(ABC):
     """Base class for all communication channels"""
     
+    # Channel row ids by name, shared by every instance in the process; a channel's id never changes
+    _channel_ids = {}
+    
     def __init__(self, channel_name, channel_type):
         self.channel_name = channel_name
         self.channel_type = channel_type
-        self.channel_db = self._get_or_create_channel()
+        self.channel_id = self._get_or_create_channel_id()
+    
+    def _get_or_create_channel_id(self):
+        """Get or create channel in database, returning its id (looked up once per process)"""
+        channel_id = BaseChannel._channel_ids.get(self.channel_name)
+        if channel_id is None:
+            channel = Channel.query.filter_by(name=self.channel_name).first()
+            if not channel:
+                channel = Channel(
+                    name=self.channel_name,
+                    type=self.channel_type,
+                    is_active=True
+                )
+                db.session.add(channel)
+                db.session.commit()
+            channel_id = BaseChannel._channel_ids[self.channel_name] = channel.id
+        return channel_id
     
-    def _get_or_create_channel(self):
-        """Get or create channel in database"""
-        channel = Channel.query.filter_by(name=self.channel_name).first()
-        if not channel:
-            channel = Channel(
-                name=self.channel_name,
-                type=self.channel_type,
-                is_active=True
-            )
-            db.session.add(channel)
-            db.session.commit()
-        return channel
+    def flush(self):
+        """Write pending sessions and messages without committing (assigns their ids)"""
+        db.session.flush()
     
     def create_session(self, user_id=None, channel_user_id=None, context=None):
-        """Create a new conversation session"""
+        """Create a new conversation session (added to the DB session; the caller commits)"""
         session_id = str(uuid.uuid4())
         session = ConversationSession(
             session_id=session_id,
             user_id=user_id,
-            channel_id=self.channel_db.id,
+            channel_id=self.channel_id,
             channel_user_id=channel_user_id,
             status='active',
             context=context
@@ -41,49 +66,50 @@ class BaseChannel(ABC):
         if context:
             session.set_context(context)
         db.session.add(session)
-        db.session.commit()
         return session
     
-    def get_session(self, session_id=None, channel_user_id=None):
-        """Get existing session by session_id or channel_user_id"""
+    def get_session(self, session_id=None, channel_user_id=None, load_messages=False):
+        """Get existing session by session_id or channel_user_id (load_messages=True when rendering its history)"""
+        query = ConversationSession.query
+        if load_messages:
+            query = query.options(selectinload(ConversationSession.messages))
         if session_id:
-            return ConversationSession.query.filter_by(
+            return query.filter_by(
                 session_id=session_id,
-                channel_id=self.channel_db.id
+                channel_id=self.channel_id
             ).first()
         elif channel_user_id:
-            return ConversationSession.query.filter_by(
+            return query.filter_by(
                 channel_user_id=channel_user_id,
-                channel_id=self.channel_db.id,
+                channel_id=self.channel_id,
                 status='active'
             ).order_by(ConversationSession.last_activity.desc()).first()
         return None
     
     def save_message(self, session, content, direction='inbound', message_type='text', 
                      content_url=None, channel_message_id=None, metadata=None):
-        """Save a message to the database"""
+        """Add a message to the DB session (the caller commits)"""
         message = ConversationMessage(
-            session_id=session.id,
+            session=session,
             message_type=message_type,
             direction=direction,
             content=content,
             content_url=content_url,
-            channel_message_id=channel_message_id,
-            metadata=metadata
+            channel_message_id=channel_message_id
         )
+        if metadata is not None:
+            message.set_metadata(metadata)
         db.session.add(message)
         
         # Update session activity
         session.last_activity = datetime.utcnow()
-        db.session.commit()
         return message
     
     def update_session_context(self, session, context_updates):
-        """Update session context"""
+        """Update session context (the caller commits, together with any messages saved this turn)"""
         current_context = session.get_context()
         current_context.update(context_updates)
         session.set_context(current_context)
-        db.session.commit()
     
     @abstractmethod
     def send_message(self, session, message, **kwargs):
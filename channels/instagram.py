@@ -1,7 +1,7 @@
 """
 Instagram channel via Meta API
 """
-from .base import BaseChannel
+from .base import BaseChannel, http_session
 from models import db
 import requests
 import os
@@ -39,7 +39,7 @@ class InstagramChannel(BaseChannel):
         }
         
         try:
-            response = requests.post(url, params=params, json=payload)
+            response = http_session.post(url, params=params, json=payload, timeout=(3, 10))
             response.raise_for_status()
             
             # Save message to database
@@ -57,38 +57,43 @@ class InstagramChannel(BaseChannel):
             raise
     
     def receive_message(self, data, **kwargs):
-        """Receive DM from Instagram webhook"""
-        entry = data.get('entry', [{}])[0]
-        messaging = entry.get('messaging', [{}])[0]
-        
-        sender_id = messaging.get('sender', {}).get('id')
-        message = messaging.get('message', {})
-        message_text = message.get('text', '')
-        message_id = message.get('mid')
+        """Receive DM from Instagram webhook (the first messaging event only)"""
+        results = self.receive_messages(data)
+        return results[0] if results else None
+    
+    def receive_messages(self, data):
+        """Receive every DM in an Instagram webhook payload, one result per messaging event"""
+        events = []
+        for entry in data.get('entry') or []:
+            for messaging in entry.get('messaging') or []:
+                sender_id = messaging.get('sender', {}).get('id')
+                if sender_id:
+                    events.append((sender_id, messaging.get('message', {})))
         
-        if not sender_id:
-            return None
+        # Resolve each sender's session once, before any message rows are pending, so the
+        # session lookups don't autoflush messages and all inserts go out in one batch
+        sessions = {}
+        for sender_id, _ in events:
+            if sender_id not in sessions:
+                sessions[sender_id] = self.get_session(channel_user_id=sender_id) or \
+                    self.create_session(channel_user_id=sender_id)
         
-        # Get or create session
-        session = self.get_session(channel_user_id=sender_id)
-        if not session:
-            session = self.create_session(
-                channel_user_id=sender_id
+        results = []
+        for sender_id, message in events:
+            session = sessions[sender_id]
+            # Save incoming message
+            saved_message = self.save_message(
+                session=session,
+                content=message.get('text', ''),
+                direction='inbound',
+                message_type='text',
+                channel_message_id=message.get('mid')
             )
-        
-        # Save incoming message
-        saved_message = self.save_message(
-            session=session,
-            content=message_text,
-            direction='inbound',
-            message_type='text',
-            channel_message_id=message_id
-        )
-        
-        return {
-            'session': session,
-            'message': saved_message
-        }
+            results.append({
+                'session': session,
+                'message': saved_message
+            })
+        return results
     
     def setup_webhook(self, callback_url):
         """Setup webhook for Instagram"""
@@ -1,18 +1,27 @@
 """
 Voice channel with ASR and TTS
 """
-from .base import BaseChannel
+from .base import BaseChannel, http_session
 from models import db
 import os
-import requests
 import base64
 from io import BytesIO
 
+class AudioTooLargeError(ValueError):
+    """Audio is larger than VoiceChannel.MAX_AUDIO_BYTES"""
+
 class VoiceChannel(BaseChannel):
     """Voice channel implementation with ASR/TTS"""
     
+    AUDIO_CHUNK_SIZE = 64 * 1024  # bytes per chunk when streaming audio to ASR
+    MAX_AUDIO_BYTES = int(os.getenv('ASR_MAX_AUDIO_BYTES', str(25 * 1024 * 1024)))  # larger audio is rejected
+    NOT_UNDERSTOOD_MESSAGE = "Sorry, I couldn't understand that. Could you please repeat?"
+    
     def __init__(self):
         super().__init__('voice', 'voice')
+        # Transcriptions below this confidence are not processed any further
+        self.min_confidence = float(os.getenv('ASR_MIN_CONFIDENCE', '0.4'))
+        self._not_understood_audio = {}
         # You can use services like Google Cloud Speech-to-Text, AWS Transcribe, etc.
         self.asr_service = os.getenv('ASR_SERVICE', 'google')  # google, aws, azure
         self.tts_service = os.getenv('TTS_SERVICE', 'google')  # google, aws, azure
@@ -25,34 +34,65 @@ class VoiceChannel(BaseChannel):
         # Could use phone number verification, PIN, etc.
         return True
     
+    def _audio_chunks(self, audio_data):
+        """Yield audio in chunks from bytes or a file-like object (e.g. an upload stream)"""
+        if isinstance(audio_data, (bytes, bytearray, memoryview)):
+            if len(audio_data) > self.MAX_AUDIO_BYTES:
+                raise AudioTooLargeError("Audio exceeds the maximum size")
+            view = memoryview(audio_data)
+            for start in range(0, len(view), self.AUDIO_CHUNK_SIZE):
+                yield view[start:start + self.AUDIO_CHUNK_SIZE]
+            return
+        total = 0
+        while True:
+            chunk = audio_data.read(self.AUDIO_CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > self.MAX_AUDIO_BYTES:
+                raise AudioTooLargeError("Audio exceeds the maximum size")
+            yield chunk
+    
     def transcribe_audio(self, audio_data, language='en-US'):
-        """Transcribe audio to text using ASR"""
+        """Transcribe audio (bytes or a file-like stream) to text using ASR
+
+        Raises AudioTooLargeError once more than MAX_AUDIO_BYTES have been read.
+        """
+        audio_chunks = self._audio_chunks(audio_data)
         if self.asr_service == 'google':
-            return self._transcribe_google(audio_data, language)
+            return self._transcribe_google(audio_chunks, language)
         elif self.asr_service == 'aws':
-            return self._transcribe_aws(audio_data, language)
+            return self._transcribe_aws(audio_chunks, language)
         else:
             raise ValueError(f"Unsupported ASR service: {self.asr_service}")
     
-    def _transcribe_google(self, audio_data, language):
-        """Transcribe using Google Cloud Speech-to-Text"""
+    def _transcribe_google(self, audio_chunks, language):
+        """Transcribe using Google Cloud Speech-to-Text, streaming the audio chunk by chunk"""
         try:
             # This is a placeholder - you'd use the actual Google Cloud Speech API
             # from google.cloud import speech
             # client = speech.SpeechClient()
+            # requests = (speech.StreamingRecognizeRequest(audio_content=bytes(chunk))
+            #             for chunk in audio_chunks)
             # ...
-            # For now, return a placeholder
+            # For now, read through the audio and return a placeholder
+            for _ in audio_chunks:
+                pass
             return {
                 'text': '[Transcription placeholder]',
                 'confidence': 0.95
             }
+        except AudioTooLargeError:
+            raise
         except Exception as e:
             print(f"Error transcribing with Google: {e}")
             return None
     
-    def _transcribe_aws(self, audio_data, language):
-        """Transcribe using AWS Transcribe"""
+    def _transcribe_aws(self, audio_chunks, language):
+        """Transcribe using AWS Transcribe, streaming the audio chunk by chunk"""
         # Placeholder for AWS implementation
+        for _ in audio_chunks:
+            pass
         return {
             'text': '[Transcription placeholder]',
             'confidence': 0.95
@@ -90,6 +130,20 @@ class VoiceChannel(BaseChannel):
             'format': 'mp3'
         }
     
+    def is_understood(self, transcription):
+        """Check that a transcription has text and enough confidence to act on"""
+        return bool(transcription.get('text', '').strip()) and \
+            transcription.get('confidence', 1.0) >= self.min_confidence
+    
+    def get_not_understood_audio(self, language='en-US'):
+        """Synthesized "could not understand" prompt, generated once per language"""
+        audio_result = self._not_understood_audio.get(language)
+        if audio_result is None:
+            audio_result = self.synthesize_speech(self.NOT_UNDERSTOOD_MESSAGE, language)
+            if audio_result:
+                self._not_understood_audio[language] = audio_result
+        return audio_result
+    
     def send_message(self, session, message, **kwargs):
         """Send voice message (convert text to speech)"""
         language = kwargs.get('language', 'en-US')
@@ -126,21 +180,35 @@ class VoiceChannel(BaseChannel):
         if not audio_data and not audio_url:
             raise ValueError("No audio data provided")
         
-        # If URL provided, fetch audio
+        # If URL provided, stream the audio into transcription
         if audio_url:
             try:
-                response = requests.get(audio_url)
-                audio_data = response.content
+                with http_session.get(audio_url, stream=True, timeout=(3, 30)) as response:
+                    response.raise_for_status()
+                    if int(response.headers.get('Content-Length') or 0) > self.MAX_AUDIO_BYTES:
+                        print(f"Audio at {audio_url} exceeds {self.MAX_AUDIO_BYTES} bytes")
+                        return None
+                    response.raw.decode_content = True
+                    transcription = self.transcribe_audio(response.raw, language)
+            except AudioTooLargeError:
+                raise
             except Exception as e:
                 print(f"Error fetching audio: {e}")
                 return None
-        
-        # Transcribe audio
-        transcription = self.transcribe_audio(audio_data, language)
+        else:
+            transcription = self.transcribe_audio(audio_data, language)
         
         if not transcription:
             return None
         
+        # Don't open a session or store anything for audio we couldn't understand
+        if not self.is_understood(transcription):
+            return {
+                'session': None,
+                'message': None,
+                'transcription': transcription
+            }
+        
         text = transcription['text']
         
         # Get or create session
@@ -157,7 +225,7 @@ class VoiceChannel(BaseChannel):
             direction='inbound',
             message_type='audio',
             content_url=audio_url,
-            metadata=str(transcription)
+            metadata=transcription
         )
         
         return {
@@ -3,9 +3,24 @@ Website chat channel with WebSocket support
 """
 from .base import BaseChannel
 from models import db, AuthenticationToken
+from utils.cache import cache_manager
 from datetime import datetime, timedelta
 import secrets
 
+# How long a validated token is trusted from cache; last_used is written at most this often per token
+TOKEN_CACHE_TTL = 60
+
+def token_cache_key(token_hash):
+    """Cache key for a token's [user_id, expiry timestamp, channel_id], by the token's digest"""
+    return f"tok:{token_hash}"
+
+def cache_token(token_hash, auth_token):
+    """Remember a valid token's owner, expiry and channel for TOKEN_CACHE_TTL seconds"""
+    expires_ts = auth_token.expires_at.timestamp() if auth_token.expires_at else None
+    cache_manager.set(
+        token_cache_key(token_hash), [auth_token.user_id, expires_ts, auth_token.channel_id], TOKEN_CACHE_TTL
+    )
+
 class WebsiteChannel(BaseChannel):
     """Website chat channel implementation"""
     
@@ -17,34 +32,50 @@ class WebsiteChannel(BaseChannel):
         if not token:
             return None
         
-        auth_token = AuthenticationToken.query.filter_by(
-            token=token,
-            channel_id=self.channel_db.id,
+        token_hash = AuthenticationToken.hash_token(token)
+        cached = cache_manager.get(token_cache_key(token_hash))
+        if cached is not None:
+            user_id, expires_ts, channel_id = cached
+            # The API path caches tokens of every channel; only this channel's are valid here
+            if channel_id != self.channel_id:
+                return None
+            if expires_ts is not None and expires_ts < datetime.utcnow().timestamp():
+                return None
+            return user_id
+        
+        auth_token = AuthenticationToken.query.filter(
+            AuthenticationToken.token_matches(token)
+        ).filter_by(
+            channel_id=self.channel_id,
             is_active=True
         ).first()
         
         if auth_token and auth_token.is_valid():
-            # Update last used
+            # Update last used (only on cache misses, so at most once per TOKEN_CACHE_TTL)
             auth_token.last_used = datetime.utcnow()
             db.session.commit()
+            cache_token(token_hash, auth_token)
             return auth_token.user_id
         return None
     
     def generate_token(self, user_id, expires_days=30, name=None):
         """Generate authentication token for user"""
         token = secrets.token_urlsafe(32)
+        token_hash = AuthenticationToken.hash_token(token)
         expires_at = datetime.utcnow() + timedelta(days=expires_days)
         
+        # Only the digest is stored; the raw token is returned to the caller once
         auth_token = AuthenticationToken(
-            token=token,
+            token=token_hash,
             user_id=user_id,
-            channel_id=self.channel_db.id,
+            channel_id=self.channel_id,
             name=name or f"Website Chat Token - {datetime.utcnow().strftime('%Y-%m-%d')}",
             expires_at=expires_at,
             is_active=True
         )
         db.session.add(auth_token)
         db.session.commit()
+        cache_token(token_hash, auth_token)
         return token
     
     def send_message(self, session, message, **kwargs):
@@ -63,17 +94,19 @@ class WebsiteChannel(BaseChannel):
         user_id = kwargs.get('user_id')
         session_id = kwargs.get('session_id')
         channel_user_id = kwargs.get('channel_user_id')
+        session = kwargs.get('session')  # callers that already loaded it skip the lookup
         
         # Get or create session
-        if session_id:
-            session = self.get_session(session_id=session_id)
-        else:
-            session = self.get_session(channel_user_id=channel_user_id)
-            if not session:
-                session = self.create_session(
-                    user_id=user_id,
-                    channel_user_id=channel_user_id
-                )
+        if session is None:
+            if session_id:
+                session = self.get_session(session_id=session_id)
+            else:
+                session = self.get_session(channel_user_id=channel_user_id)
+                if not session:
+                    session = self.create_session(
+                        user_id=user_id,
+                        channel_user_id=channel_user_id
+                    )
         
         # Save incoming message
         message_content = data.get('message', '')
@@ -82,7 +115,7 @@ class WebsiteChannel(BaseChannel):
             content=message_content,
             direction='inbound',
             message_type='text',
-            metadata=str(data)
+            metadata=data
         )
         
         return {
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 from datetime import date, datetime
 
 # List of exhibits available in the museum
@@ -10,10 +11,13 @@ EXHIBITS = [
 ]
 
 # Time slots available for booking
-TIME_SLOTS = [
+TIME_SLOTS = (
     "9AM–10AM", "10AM–11AM", "11AM–12PM", 
     "1PM–2PM", "2PM–3PM", "3PM–4PM"
-]
+)
+
+# Lowercased, ASCII-dash form of each slot as matched against user messages
+TIME_SLOT_KEYS = tuple((slot, slot.lower().replace('–', '-')) for slot in TIME_SLOTS)
 
 # Enhanced patterns with more comprehensive responses
 patterns = {
@@ -61,30 +65,40 @@ patterns = {
     r'(contact|email|phone|address|reach|get.*touch)': "For additional support:\n• Use this chatbot anytime (24/7)\n• Check the 'Contact' page for more options\n• Visit /contact for contact form\n\nI'm here to help with most questions though! What do you need?",
 }
 
+# Lookup tables derived from the data above, built once at import
+EXHIBIT_RESPONSES = tuple((exhibit.lower(), f"Great! We have the '{exhibit}' in our collection! 🎨\n\nYou can view it in stunning 3D detail on our 'Explore Exhibits' page. The 3D viewer allows you to:\n• Rotate the exhibit 360°\n• Zoom in for details\n• View from different angles\n\nWould you like to know about other exhibits or help with booking tickets?") for exhibit in EXHIBITS)
+TIME_SLOT_RESPONSES = tuple((slot_key, f"The {slot} time slot is available for booking! 📅\n\nTo book this slot:\n1. Go to the Calendar page\n2. Select your preferred date\n3. Click on the date to see all available slots\n4. Choose {slot} and complete your booking\n\nEach slot has limited capacity, so book early to secure your spot!") for slot, slot_key in TIME_SLOT_KEYS)
+COMPILED_PATTERNS = tuple((re.compile(pattern), response) for pattern, response in patterns.items())
+
+EMPTY_MESSAGE_RESPONSE = "Please ask me a question! I can help with booking tickets, exhibits, and more."
+DEFAULT_RESPONSE = "I'm not sure I understood that. 🤔\n\nI can help you with:\n• Booking tickets - ask 'How do I book a ticket?'\n• Exhibits - ask 'What exhibits do you have?'\n• Time slots - ask 'What time slots are available?'\n• Policies - ask 'What are your policies?'\n• Navigation - ask 'How do I navigate the site?'\n\nTry asking one of these questions, or rephrase your question!"
+
 def get_chatbot_response(user_message):
     """
     Enhanced chatbot that provides helpful responses about ticket booking and exhibits.
     """
     if not user_message or not user_message.strip():
-        return "Please ask me a question! I can help with booking tickets, exhibits, and more."
-    
-    user_message = user_message.lower().strip()
+        return EMPTY_MESSAGE_RESPONSE
     
+    return _response_for(user_message.lower().strip())
+
+@lru_cache(maxsize=4096)
+def _response_for(user_message):
+    """Response for a normalized (lowercased, stripped) message; replies depend only on the text"""
     # Check for specific exhibit names
-    for exhibit in EXHIBITS:
-        exhibit_lower = exhibit.lower()
-        if exhibit_lower in user_message:
-            return f"Great! We have the '{exhibit}' in our collection! 🎨\n\nYou can view it in stunning 3D detail on our 'Explore Exhibits' page. The 3D viewer allows you to:\n• Rotate the exhibit 360°\n• Zoom in for details\n• View from different angles\n\nWould you like to know about other exhibits or help with booking tickets?"
+    for exhibit_key, response in EXHIBIT_RESPONSES:
+        if exhibit_key in user_message:
+            return response
     
     # Check for time slot queries
-    for slot in TIME_SLOTS:
-        if slot.lower().replace('–', '-').replace('am', 'am').replace('pm', 'pm') in user_message:
-            return f"The {slot} time slot is available for booking! 📅\n\nTo book this slot:\n1. Go to the Calendar page\n2. Select your preferred date\n3. Click on the date to see all available slots\n4. Choose {slot} and complete your booking\n\nEach slot has limited capacity, so book early to secure your spot!"
+    for slot_key, response in TIME_SLOT_RESPONSES:
+        if slot_key in user_message:
+            return response
     
     # Check patterns
-    for pattern, response in patterns.items():
-        if re.search(pattern, user_message):
+    for pattern, response in COMPILED_PATTERNS:
+        if pattern.search(user_message):
             return response
     
     # Default response with suggestions
-    return "I'm not sure I understood that. 🤔\n\nI can help you with:\n• Booking tickets - ask 'How do I book a ticket?'\n• Exhibits - ask 'What exhibits do you have?'\n• Time slots - ask 'What time slots are available?'\n• Policies - ask 'What are your policies?'\n• Navigation - ask 'How do I navigate the site?'\n\nTry asking one of these questions, or rephrase your question!"
+    return DEFAULT_RESPONSE
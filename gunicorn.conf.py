@@ -0,0 +1,15 @@
+"""
+Gunicorn configuration
+"""
+
+# Green worker so SocketIO connections and I/O-bound chatbot requests multiplex within a worker.
+# Socket.IO needs sticky sessions across workers; scale with -w N only behind a sticky load balancer.
+worker_class = 'eventlet'
+
+def post_fork(server, worker):
+    """Give each worker its own DB connections when the app is preloaded in the master"""
+    if not server.cfg.preload_app:
+        return
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,27 @@
+"""add keyset pagination indexes
+
+Revision ID: a3c91d5e7f20
+Revises: e7e7b2c9b427
+Create Date: 2026-10-14 09:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c91d5e7f20'
+down_revision = 'e7e7b2c9b427'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (created_at, id) lets the admin list views seek to a cursor instead of OFFSET scanning
+    op.create_index('idx_bookings_created_id', 'bookings', ['created_at', 'id'])
+    op.create_index('idx_user_created_id', 'user', ['created_at', 'id'])
+
+
+def downgrade():
+    op.drop_index('idx_user_created_id', table_name='user')
+    op.drop_index('idx_bookings_created_id', table_name='bookings')
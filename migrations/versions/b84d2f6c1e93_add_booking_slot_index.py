@@ -0,0 +1,25 @@
+"""add booking slot index
+
+Revision ID: b84d2f6c1e93
+Revises: a3c91d5e7f20
+Create Date: 2026-10-14 11:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b84d2f6c1e93'
+down_revision = 'a3c91d5e7f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Availability checks SUM(visitors) per (date, time_slot); covering index keeps them index-only
+    op.create_index('idx_bookings_date_slot', 'bookings', ['date', 'time_slot', 'visitors'])
+
+
+def downgrade():
+    op.drop_index('idx_bookings_date_slot', table_name='bookings')
@@ -0,0 +1,25 @@
+"""add booking user created index
+
+Revision ID: c2f4a8d61b57
+Revises: b84d2f6c1e93
+Create Date: 2026-10-14 14:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f4a8d61b57'
+down_revision = 'b84d2f6c1e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Booking conversion metrics select the users who booked within a period
+    op.create_index('idx_bookings_user_created', 'bookings', ['user_id', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('idx_bookings_user_created', table_name='bookings')
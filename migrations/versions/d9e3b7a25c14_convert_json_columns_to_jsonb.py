@@ -0,0 +1,55 @@
+"""convert json columns to jsonb
+
+Revision ID: d9e3b7a25c14
+Revises: c2f4a8d61b57
+Create Date: 2026-10-14 15:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9e3b7a25c14'
+down_revision = 'c2f4a8d61b57'
+branch_labels = None
+depends_on = None
+
+# JSON payloads that were stored as Text; these tables come from db.create_all()
+JSON_COLUMNS = (
+    ('channels', 'config'),
+    ('conversation_sessions', 'context'),
+    ('conversation_sessions', 'session_metadata'),
+    ('conversation_messages', 'message_metadata'),
+    ('conversation_messages', 'entities'),
+    ('authentication_tokens', 'permissions'),
+)
+
+
+def upgrade():
+    # Only PostgreSQL has JSONB; elsewhere the JSON type is stored as text already
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    
+    inspector = sa.inspect(bind)
+    for table, column in JSON_COLUMNS:
+        if inspector.has_table(table):
+            op.alter_column(table, column, type_=postgresql.JSONB(), postgresql_using=f'{column}::jsonb')
+    
+    if inspector.has_table('conversation_sessions'):
+        op.execute('CREATE INDEX IF NOT EXISTS idx_sessions_context_gin '
+                   'ON conversation_sessions USING gin (context jsonb_path_ops)')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    
+    op.execute('DROP INDEX IF EXISTS idx_sessions_context_gin')
+    inspector = sa.inspect(bind)
+    for table, column in JSON_COLUMNS:
+        if inspector.has_table(table):
+            op.alter_column(table, column, type_=sa.Text(), postgresql_using=f'{column}::text')
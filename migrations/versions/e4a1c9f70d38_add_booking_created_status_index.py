@@ -0,0 +1,25 @@
+"""add booking created status index
+
+Revision ID: e4a1c9f70d38
+Revises: d9e3b7a25c14
+Create Date: 2026-10-14 16:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a1c9f70d38'
+down_revision = 'd9e3b7a25c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Successful-booking metrics filter payment_status within a created_at range
+    op.create_index('idx_bookings_created_status', 'bookings', ['created_at', 'payment_status'])
+
+
+def downgrade():
+    op.drop_index('idx_bookings_created_status', table_name='bookings')
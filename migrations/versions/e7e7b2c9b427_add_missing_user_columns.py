@@ -21,19 +21,28 @@ def upgrade():
     # Note: batch_alter_table doesn't work well with PostgreSQL, use direct column addition
     op.add_column('user', sa.Column('email', sa.String(length=120), nullable=True))
     op.add_column('user', sa.Column('phone', sa.String(length=20), nullable=True))
-    op.add_column('user', sa.Column('created_at', sa.DateTime(), nullable=True))
     op.add_column('user', sa.Column('last_login', sa.DateTime(), nullable=True))
-    op.add_column('user', sa.Column('is_active', sa.Boolean(), nullable=True))
-    op.add_column('user', sa.Column('role', sa.String(length=20), nullable=True))
     
-    # Set default values for existing rows
-    op.execute("UPDATE \"user\" SET is_active = true WHERE is_active IS NULL")
-    op.execute("UPDATE \"user\" SET role = 'user' WHERE role IS NULL")
-    op.execute("UPDATE \"user\" SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
-    
-    # Set server defaults for future rows (optional, but helps)
-    # Note: We can't easily add server defaults after the fact in PostgreSQL without recreating the column
-    # So we'll just ensure existing rows have values
+    if op.get_bind().dialect.name == 'postgresql':
+        # Existing rows take their value from a server default. On PostgreSQL 11+ a non-volatile
+        # default is a catalog-only change, unlike an UPDATE that rewrites every row under an
+        # exclusive lock. The defaults are dropped again; new rows get their values from the model.
+        op.add_column('user', sa.Column('created_at', sa.DateTime(), nullable=True, server_default=sa.func.current_timestamp()))
+        op.add_column('user', sa.Column('is_active', sa.Boolean(), nullable=True, server_default=sa.true()))
+        op.add_column('user', sa.Column('role', sa.String(length=20), nullable=True, server_default='user'))
+        
+        for column in ('created_at', 'is_active', 'role'):
+            op.alter_column('user', column, server_default=None)
+    else:
+        # e.g. SQLite, which can't add a column with a CURRENT_TIMESTAMP default or drop defaults
+        op.add_column('user', sa.Column('created_at', sa.DateTime(), nullable=True))
+        op.add_column('user', sa.Column('is_active', sa.Boolean(), nullable=True))
+        op.add_column('user', sa.Column('role', sa.String(length=20), nullable=True))
+        
+        # Set default values for existing rows
+        op.execute("UPDATE \"user\" SET is_active = true WHERE is_active IS NULL")
+        op.execute("UPDATE \"user\" SET role = 'user' WHERE role IS NULL")
+        op.execute("UPDATE \"user\" SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
 
 
 def downgrade():
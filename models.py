@@ -1,10 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from sqlalchemy import Index
-import json
+from sqlalchemy.dialects.postgresql import JSONB
+from werkzeug.security import generate_password_hash, check_password_hash
+import hmac
+import hashlib
+import orjson
 
 db = SQLAlchemy()
 
+# JSON payload columns: binary JSONB on PostgreSQL, JSON stored as text elsewhere (e.g. SQLite in dev)
+JSONType = db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql')
+
+def _json_serializer(value):
+    """orjson encoder for JSON columns (non-string keys allowed, as with the old Text encoding)"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+# Engine options so SQLAlchemy (de)serializes JSON columns with orjson
+JSON_ENGINE_OPTIONS = {'json_serializer': _json_serializer, 'json_deserializer': orjson.loads}
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -18,6 +32,21 @@ class User(db.Model):
     
     # Role-based access (admin, manager, staff, user)
     role = db.Column(db.String(20), default='user')  # admin, manager, staff, user
+    
+    PASSWORD_HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+    
+    def set_password(self, password):
+        """Store a salted hash of the password"""
+        self.password = generate_password_hash(password, method='pbkdf2:sha256')
+    
+    def check_password(self, password):
+        """Verify a password; legacy plaintext values are re-hashed on a successful match"""
+        if self.password.startswith(self.PASSWORD_HASH_PREFIXES):
+            return check_password_hash(self.password, password)
+        if hmac.compare_digest(self.password.encode(), password.encode()):
+            self.set_password(password)
+            return True
+        return False
 
 class Ticket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,17 +79,18 @@ class Booking(db.Model):
     user = db.relationship('User', backref=db.backref('bookings', lazy=True))
 
     def to_dict(self):
+        # Dates stay as objects; the orjson JSON provider writes them as ISO 8601
         return {
             "id": self.id,
             "user_id": self.user_id,
-            "date": self.date.isoformat(),
+            "date": self.date,
             "time_slot": self.time_slot,
             "visitors": self.visitors,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "created_at": self.created_at,
             "payment_status": self.payment_status,
             "amount": float(self.amount) if self.amount else None,
             "currency": self.currency,
-            "paid_at": self.paid_at.isoformat() if self.paid_at else None
+            "paid_at": self.paid_at
         }
     
     def calculate_amount(self, price_per_visitor=100):
@@ -77,19 +107,19 @@ class Channel(db.Model):
     name = db.Column(db.String(50), nullable=False, unique=True)  # website, instagram, voice, sms
     type = db.Column(db.String(50), nullable=False)  # chat, voice, social
     is_active = db.Column(db.Boolean, default=True)
-    config = db.Column(db.Text, nullable=True)  # JSON config for channel-specific settings
+    config = db.Column(JSONType, nullable=True)  # JSON config for channel-specific settings
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def get_config(self):
-        """Parse and return config JSON"""
+        """Return a copy of the config (pass edits back through set_config)"""
         if self.config:
-            return json.loads(self.config)
+            return dict(self.config)
         return {}
     
     def set_config(self, config_dict):
-        """Set config as JSON"""
-        self.config = json.dumps(config_dict)
+        """Set config"""
+        self.config = config_dict
 
 class ConversationSession(db.Model):
     """Manages conversation sessions across channels"""
@@ -103,8 +133,8 @@ class ConversationSession(db.Model):
     
     # Session state
     status = db.Column(db.String(20), default='active')  # active, closed, escalated
-    context = db.Column(db.Text, nullable=True)  # JSON context data
-    session_metadata = db.Column(db.Text, nullable=True)  # Additional metadata (renamed from metadata to avoid SQLAlchemy conflict)
+    context = db.Column(JSONType, nullable=True)  # JSON context data
+    session_metadata = db.Column(JSONType, nullable=True)  # Additional metadata (renamed from metadata to avoid SQLAlchemy conflict)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -114,14 +144,14 @@ class ConversationSession(db.Model):
     channel = db.relationship('Channel', backref=db.backref('sessions', lazy=True))
     
     def get_context(self):
-        """Parse and return context JSON"""
+        """Return a copy of the context (pass edits back through set_context)"""
         if self.context:
-            return json.loads(self.context)
+            return dict(self.context)
         return {}
     
     def set_context(self, context_dict):
-        """Set context as JSON"""
-        self.context = json.dumps(context_dict)
+        """Set context"""
+        self.context = context_dict
         self.updated_at = datetime.utcnow()
         self.last_activity = datetime.utcnow()
 
@@ -138,26 +168,36 @@ class ConversationMessage(db.Model):
     
     # Channel-specific metadata
     channel_message_id = db.Column(db.String(255), nullable=True)  # Message ID from channel
-    message_metadata = db.Column(db.Text, nullable=True)  # Additional metadata as JSON (renamed from metadata to avoid SQLAlchemy conflict)
+    message_metadata = db.Column(JSONType, nullable=True)  # Additional metadata as JSON (renamed from metadata to avoid SQLAlchemy conflict)
     
     # Processing info
     processed = db.Column(db.Boolean, default=False)
     intent = db.Column(db.String(100), nullable=True)
-    entities = db.Column(db.Text, nullable=True)  # JSON entities
+    entities = db.Column(JSONType, nullable=True)  # JSON entities
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     session = db.relationship('ConversationSession', backref=db.backref('messages', lazy=True, order_by='ConversationMessage.created_at'))
     
     def get_entities(self):
-        """Parse and return entities JSON"""
+        """Return a copy of the entities (pass edits back through set_entities)"""
         if self.entities:
-            return json.loads(self.entities)
+            return list(self.entities)
         return []
     
     def set_entities(self, entities_list):
-        """Set entities as JSON"""
-        self.entities = json.dumps(entities_list)
+        """Set entities"""
+        self.entities = entities_list
+    
+    def get_metadata(self):
+        """Return a copy of the metadata (pass edits back through set_metadata)"""
+        if self.message_metadata:
+            return dict(self.message_metadata)
+        return {}
+    
+    def set_metadata(self, metadata_dict):
+        """Set metadata"""
+        self.message_metadata = metadata_dict
 
 class AuthenticationToken(db.Model):
     """Token-based authentication for API access"""
@@ -175,7 +215,7 @@ class AuthenticationToken(db.Model):
     last_used = db.Column(db.DateTime, nullable=True)
     
     # Permissions (JSON)
-    permissions = db.Column(db.Text, nullable=True)  # JSON array of permissions
+    permissions = db.Column(JSONType, nullable=True)  # JSON array of permissions
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -183,11 +223,25 @@ class AuthenticationToken(db.Model):
     channel = db.relationship('Channel', backref=db.backref('tokens', lazy=True))
     
     def get_permissions(self):
-        """Parse and return permissions JSON"""
+        """Return a copy of the permissions list"""
         if self.permissions:
-            return json.loads(self.permissions)
+            return list(self.permissions)
         return []
     
+    @staticmethod
+    def hash_token(token):
+        """SHA-256 hex digest of a raw token; only the digest is stored"""
+        return hashlib.sha256(token.encode()).hexdigest()
+    
+    @classmethod
+    def token_matches(cls, token):
+        """WHERE clause for a raw token (tokens issued before hashing are stored as-is)"""
+        token_hash = cls.hash_token(token)
+        if len(token) == len(token_hash):
+            # Issued tokens are never digest-length, so a presented digest must not match a stored one
+            return cls.token == token_hash
+        return cls.token.in_((token_hash, token))
+    
     def is_valid(self):
         """Check if token is valid and not expired"""
         if not self.is_active:
@@ -281,7 +335,48 @@ class Escalation(db.Model):
 
 # Indexes for performance
 Index('idx_session_id', ConversationMessage.session_id)
-Index('idx_channel_id', ConversationMessage.session_id)
 Index('idx_created_at', ConversationMessage.created_at)
 Index('idx_conversation_logs_created', ConversationLog.created_at)
 Index('idx_escalations_status', Escalation.status)
+
+# Per-slot availability sums visitors grouped by (date, time_slot); covering index avoids table reads
+Index('idx_bookings_date_slot', Booking.date, Booking.time_slot, Booking.visitors)
+
+# Booking conversion looks up the users who booked within a period
+Index('idx_bookings_user_created', Booking.user_id, Booking.created_at)
+# Paid-bookings count over a created_at range reads only the index
+Index('idx_bookings_created_status', Booking.created_at, Booking.payment_status)
+
+# Composite indexes backing keyset pagination in the admin list views
+Index('idx_bookings_created_id', Booking.created_at, Booking.id)
+Index('idx_user_created_id', User.created_at, User.id)
+Index('idx_content_created_id', ContentKnowledge.created_at, ContentKnowledge.id)
+Index('idx_escalations_status_created_id', Escalation.status, Escalation.created_at, Escalation.id)
+Index('idx_sessions_activity_id', ConversationSession.last_activity, ConversationSession.id)
+Index('idx_messages_session_created_id', ConversationMessage.session_id, ConversationMessage.created_at, ConversationMessage.id)
+
+# Channel lookup of a user's latest active session: partial index over active sessions only, newest first
+Index('idx_sessions_channel_user_active', ConversationSession.channel_id, ConversationSession.channel_user_id,
+      ConversationSession.last_activity.desc(),
+      postgresql_where=ConversationSession.status == 'active',
+      sqlite_where=ConversationSession.status == 'active')
+
+# A user's sessions, optionally per channel and status, newest first
+Index('idx_sessions_user_channel_activity', ConversationSession.user_id, ConversationSession.channel_id,
+      ConversationSession.status, ConversationSession.last_activity.desc())
+
+# Containment (@>) queries on session context; GIN only exists for JSONB
+Index('idx_sessions_context_gin', ConversationSession.context,
+      postgresql_using='gin', postgresql_ops={'context': 'jsonb_path_ops'}).ddl_if(dialect='postgresql')
+
+# Small partial indexes over the two hot status subsets: active sessions by recency,
+# closed sessions by last update for cleanup_old_sessions (PostgreSQL only)
+Index('idx_sessions_active', ConversationSession.last_activity,
+      postgresql_where=ConversationSession.status == 'active').ddl_if(dialect='postgresql')
+Index('idx_sessions_closed', ConversationSession.updated_at,
+      postgresql_where=ConversationSession.status == 'closed').ddl_if(dialect='postgresql')
+
+# Token auth only ever looks up active tokens of one channel
+Index('idx_tokens_active', AuthenticationToken.token, AuthenticationToken.channel_id,
+      postgresql_where=AuthenticationToken.is_active.is_(True),
+      sqlite_where=AuthenticationToken.is_active.is_(True))
@@ -1,14 +1,17 @@
 """
 Session Manager for cross-channel conversation continuity
 """
-from models import db, ConversationSession, ConversationMessage
+from models import db, ConversationSession, ConversationMessage, ConversationLog, Escalation
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
 from datetime import datetime, timedelta
-from channels import WebsiteChannel, InstagramChannel, VoiceChannel
+from channels import BaseChannel, WebsiteChannel, InstagramChannel, VoiceChannel
 
 class SessionManager:
     """Manages conversation sessions across all channels"""
     
     def __init__(self):
+        # Channel instances hold no DB state, so one per channel is shared across requests
         self._channels = {}
     
     def _get_channel(self, channel_name):
@@ -24,6 +27,13 @@ class SessionManager:
                 raise ValueError(f"Unknown channel: {channel_name}")
         return self._channels[channel_name]
     
+    def _get_channel_for_session(self, session):
+        """Channel a session belongs to, resolved from the cached channel ids without loading session.channel"""
+        for channel_name, channel_id in BaseChannel._channel_ids.items():
+            if channel_id == session.channel_id:
+                return self._get_channel(channel_name)
+        return self._get_channel(session.channel.name)
+    
     @property
     def channels(self):
         """Get channels dict (lazy loaded)"""
@@ -47,6 +57,7 @@ class SessionManager:
                 channel_user_id=channel_user_id,
                 context=context or {}
             )
+            db.session.commit()
         elif session.status != 'active':
             # Reactivate closed session or create new one
             session = channel.create_session(
@@ -54,6 +65,7 @@ class SessionManager:
                 channel_user_id=channel_user_id,
                 context=context or {}
             )
+            db.session.commit()
         
         return session
     
@@ -64,7 +76,7 @@ class SessionManager:
         if channel_name:
             channel = self.channels.get(channel_name)
             if channel:
-                query = query.filter_by(channel_id=channel.channel_db.id)
+                query = query.filter_by(channel_id=channel().channel_id)
         
         if active_only:
             query = query.filter_by(status='active')
@@ -77,8 +89,9 @@ class SessionManager:
     
     def update_session_context(self, session, context_updates):
         """Update session context"""
-        channel = self._get_channel(session.channel.name)
+        channel = self._get_channel_for_session(session)
         channel.update_session_context(session, context_updates)
+        db.session.commit()
     
     def transfer_session(self, session, target_channel_name, target_channel_user_id):
         """Transfer session to another channel"""
@@ -108,24 +121,51 @@ class SessionManager:
     
     def get_conversation_history(self, session, limit=50):
         """Get conversation history for a session"""
-        messages = ConversationMessage.query.filter_by(
+        # Newest `limit` messages in an inner query, returned oldest first by the outer one
+        latest = ConversationMessage.query.filter_by(
             session_id=session.id
-        ).order_by(ConversationMessage.created_at.desc()).limit(limit).all()
+        ).order_by(ConversationMessage.created_at.desc(), ConversationMessage.id.desc()).limit(limit).subquery()
+        message = aliased(ConversationMessage, latest)
         
-        return list(reversed(messages))  # Return in chronological order
+        return db.session.query(message).order_by(message.created_at, message.id).all()
+    
+    def get_conversation_history_rows(self, session, limit=50):
+        """Get conversation history as plain dicts (id, content, direction, message_type, created_at)"""
+        rows = db.session.execute(
+            select(
+                ConversationMessage.id,
+                ConversationMessage.content,
+                ConversationMessage.direction,
+                ConversationMessage.message_type,
+                ConversationMessage.created_at
+            ).where(
+                ConversationMessage.session_id == session.id
+            ).order_by(ConversationMessage.created_at.desc(), ConversationMessage.id.desc()).limit(limit)
+        ).mappings().all()
+        
+        return [dict(row) for row in reversed(rows)]  # Return in chronological order
     
     def cleanup_old_sessions(self, days_inactive=30):
         """Clean up old inactive sessions"""
         cutoff_date = datetime.utcnow() - timedelta(days=days_inactive)
         
-        old_sessions = ConversationSession.query.filter(
+        old_session_ids = select(ConversationSession.id).where(
             ConversationSession.status == 'closed',
             ConversationSession.updated_at < cutoff_date
-        ).all()
+        )
         
-        count = len(old_sessions)
-        for session in old_sessions:
-            db.session.delete(session)
+        # Bulk statements instead of loading and deleting each session: messages go with their
+        # session, logs and escalations are kept but detached (as the ORM delete would do)
+        ConversationMessage.query.filter(
+            ConversationMessage.session_id.in_(old_session_ids)
+        ).delete(synchronize_session=False)
+        for model in (ConversationLog, Escalation):
+            model.query.filter(
+                model.session_id.in_(old_session_ids)
+            ).update({model.session_id: None}, synchronize_session=False)
+        count = ConversationSession.query.filter(
+            ConversationSession.id.in_(old_session_ids)
+        ).delete(synchronize_session=False)
         
         db.session.commit()
         return count
@@ -1,11 +1,15 @@
 # Utilities package
 from .encryption import EncryptionManager, encryption_manager
-from .backup import BackupManager, backup_manager
+from .backup import BackupManager, BackupRecord, backup_manager
 from .analytics import AnalyticsManager, analytics_manager
+from .pagination import KeysetPage, keyset_paginate
+from .cache import CacheManager, cache_manager
 
 __all__ = [
     'EncryptionManager', 'encryption_manager',
-    'BackupManager', 'backup_manager',
-    'AnalyticsManager', 'analytics_manager'
+    'BackupManager', 'BackupRecord', 'backup_manager',
+    'AnalyticsManager', 'analytics_manager',
+    'KeysetPage', 'keyset_paginate',
+    'CacheManager', 'cache_manager'
 ]
 
@@ -3,11 +3,27 @@ Analytics and metrics utilities
 """
 from models import db, ConversationSession, ConversationMessage, ConversationLog, Booking, Channel
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, case, text
+from utils.cache import TTLCache
 
 class AnalyticsManager:
     """Manages analytics and metrics collection"""
     
+    def __init__(self):
+        # Admin pages all ask for the same daily window; recompute at most every 30s
+        self._daily_stats_cache = TTLCache(maxsize=32, ttl=30)
+    
+    @staticmethod
+    def _seconds_between(start, end):
+        """SQL expression for the seconds from start to end (NULL if either is NULL)"""
+        dialect_name = db.session.get_bind().dialect.name
+        if dialect_name == 'sqlite':
+            return (func.julianday(end) - func.julianday(start)) * 86400
+        if dialect_name in ('mysql', 'mariadb'):
+            return func.timestampdiff(text('SECOND'), start, end)
+        # PostgreSQL
+        return func.extract('epoch', end - start)
+    
     def get_conversation_metrics(self, start_date=None, end_date=None, channel_id=None):
         """Get conversation metrics"""
         if not start_date:
@@ -15,42 +31,31 @@ class AnalyticsManager:
         if not end_date:
             end_date = datetime.utcnow()
         
-        query = ConversationSession.query.filter(
+        session_filters = [
             ConversationSession.created_at >= start_date,
-            ConversationSession.created_at <= end_date
-        )
-        
-        if channel_id:
-            query = query.filter_by(channel_id=channel_id)
-        
-        total_sessions = query.count()
-        active_sessions = query.filter_by(status='active').count()
-        closed_sessions = query.filter_by(status='closed').count()
-        
-        # Average messages per session
-        avg_messages = db.session.query(
-            func.avg(func.count(ConversationMessage.id))
+            ConversationSession.created_at <= end_date,
+            *([ConversationSession.channel_id == channel_id] if channel_id else [])
+        ]
+        
+        # Status counts and the average closed-session duration in one pass over the period
+        is_closed = ConversationSession.status == 'closed'
+        totals = db.session.query(
+            func.count(ConversationSession.id),
+            func.count(case((ConversationSession.status == 'active', 1))),
+            func.count(case((is_closed, 1))),
+            func.avg(case((is_closed, self._seconds_between(ConversationSession.created_at, ConversationSession.updated_at))))
+        ).filter(*session_filters).one()
+        total_sessions, active_sessions, closed_sessions = totals[:3]
+        avg_duration = float(totals[3] or 0)
+        
+        # Average messages per session: count per session in a subquery, then average the counts
+        message_counts = db.session.query(
+            func.count(ConversationMessage.id).label('message_count')
         ).join(
             ConversationSession
-        ).filter(
-            ConversationSession.created_at >= start_date,
-            ConversationSession.created_at <= end_date
-        ).group_by(ConversationSession.id).scalar() or 0
-        
-        # Average session duration
-        sessions_with_duration = query.filter(
-            ConversationSession.status == 'closed'
-        ).all()
-        
-        total_duration = 0
-        count = 0
-        for session in sessions_with_duration:
-            if session.updated_at and session.created_at:
-                duration = (session.updated_at - session.created_at).total_seconds()
-                total_duration += duration
-                count += 1
+        ).filter(*session_filters).group_by(ConversationMessage.session_id).subquery()
         
-        avg_duration = total_duration / count if count > 0 else 0
+        avg_messages = float(db.session.query(func.avg(message_counts.c.message_count)).scalar() or 0)
         
         return {
             'total_sessions': total_sessions,
@@ -77,13 +82,16 @@ class AnalyticsManager:
             ConversationSession.created_at <= end_date
         ).count()
         
-        # Conversations that led to bookings
-        sessions_with_bookings = db.session.query(ConversationSession).join(
-            Booking, ConversationSession.user_id == Booking.user_id
-        ).filter(
+        # Conversations that led to bookings: semi-join against users who booked in the period
+        booking_users = db.session.query(Booking.user_id).filter(
             Booking.created_at >= start_date,
             Booking.created_at <= end_date
-        ).distinct().count()
+        )
+        sessions_with_bookings = db.session.query(func.count(ConversationSession.id)).filter(
+            ConversationSession.created_at >= start_date,
+            ConversationSession.created_at <= end_date,
+            ConversationSession.user_id.in_(booking_users)
+        ).scalar()
         
         # Total bookings
         total_bookings = Booking.query.filter(
@@ -121,24 +129,29 @@ class AnalyticsManager:
         if not end_date:
             end_date = datetime.utcnow()
         
+        # Per-channel totals in two grouped queries rather than two queries per channel
+        session_counts = dict(db.session.query(
+            ConversationSession.channel_id, func.count(ConversationSession.id)
+        ).filter(
+            ConversationSession.created_at >= start_date,
+            ConversationSession.created_at <= end_date
+        ).group_by(ConversationSession.channel_id).all())
+        
+        message_counts = dict(db.session.query(
+            ConversationSession.channel_id, func.count(ConversationMessage.id)
+        ).select_from(ConversationMessage).join(
+            ConversationSession
+        ).filter(
+            ConversationMessage.created_at >= start_date,
+            ConversationMessage.created_at <= end_date
+        ).group_by(ConversationSession.channel_id).all())
+        
         channels = Channel.query.all()
         channel_metrics = []
         
         for channel in channels:
-            sessions = ConversationSession.query.filter(
-                ConversationSession.channel_id == channel.id,
-                ConversationSession.created_at >= start_date,
-                ConversationSession.created_at <= end_date
-            ).all()
-            
-            total_sessions = len(sessions)
-            total_messages = ConversationMessage.query.join(
-                ConversationSession
-            ).filter(
-                ConversationSession.channel_id == channel.id,
-                ConversationMessage.created_at >= start_date,
-                ConversationMessage.created_at <= end_date
-            ).count()
+            total_sessions = session_counts.get(channel.id, 0)
+            total_messages = message_counts.get(channel.id, 0)
             
             channel_metrics.append({
                 'channel_id': channel.id,
@@ -153,42 +166,65 @@ class AnalyticsManager:
     
     def get_daily_stats(self, days=30):
         """Get daily statistics"""
+        stats = self._daily_stats_cache.get(days)
+        if stats is None:
+            stats = self._compute_daily_stats(days)
+            self._daily_stats_cache.set(days, stats)
+        return stats
+    
+    def _compute_daily_stats(self, days):
+        """Compute daily statistics from the database"""
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
         
+        first_day = datetime.combine(start_date.date(), datetime.min.time())
+        sessions_by_day = self._count_by_day(ConversationSession.created_at, first_day)
+        messages_by_day = self._count_by_day(ConversationMessage.created_at, first_day)
+        bookings_by_day = self._count_by_day(Booking.created_at, first_day)
+        
         daily_stats = []
         current_date = start_date.date()
         
         while current_date <= end_date.date():
-            day_start = datetime.combine(current_date, datetime.min.time())
-            day_end = datetime.combine(current_date, datetime.max.time())
-            
-            sessions = ConversationSession.query.filter(
-                ConversationSession.created_at >= day_start,
-                ConversationSession.created_at <= day_end
-            ).count()
-            
-            messages = ConversationMessage.query.filter(
-                ConversationMessage.created_at >= day_start,
-                ConversationMessage.created_at <= day_end
-            ).count()
-            
-            bookings = Booking.query.filter(
-                Booking.created_at >= day_start,
-                Booking.created_at <= day_end
-            ).count()
-            
+            day = current_date.isoformat()
             daily_stats.append({
-                'date': current_date.isoformat(),
-                'sessions': sessions,
-                'messages': messages,
-                'bookings': bookings
+                'date': day,
+                'sessions': sessions_by_day.get(day, 0),
+                'messages': messages_by_day.get(day, 0),
+                'bookings': bookings_by_day.get(day, 0)
             })
             
             current_date += timedelta(days=1)
         
         return daily_stats
 
+    @staticmethod
+    def _count_by_day(created_at, since):
+        """Row counts per ISO day of created_at from since onwards, in one grouped query"""
+        day = func.date(created_at)
+        rows = db.session.query(day, func.count()).filter(created_at >= since).group_by(day).all()
+        # SQLite returns the day as a string, PostgreSQL as a date
+        return {str(row_day): count for row_day, count in rows}
+    
+    def get_slot_occupancy(self, start_date=None, end_date=None):
+        """Get visitors booked per time slot for each date in a range"""
+        if not start_date:
+            start_date = datetime.utcnow().date() - timedelta(days=30)
+        if not end_date:
+            end_date = datetime.utcnow().date() + timedelta(days=30)
+        
+        rows = db.session.query(
+            Booking.date, Booking.time_slot, func.sum(Booking.visitors)
+        ).filter(
+            Booking.date >= start_date,
+            Booking.date <= end_date
+        ).group_by(Booking.date, Booking.time_slot).all()
+        
+        occupancy = {}
+        for booking_date, time_slot, visitors in rows:
+            occupancy.setdefault(booking_date.isoformat(), {})[time_slot] = int(visitors or 0)
+        return occupancy
+
 # Global analytics manager instance
 analytics_manager = AnalyticsManager()
 
@@ -0,0 +1,113 @@
+"""
+Caching utilities
+"""
+import os
+import threading
+import time
+import orjson
+import redis
+
+class TTLCache:
+    """Small thread-safe in-process cache whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache a value (for ``ttl`` seconds if given), evicting the oldest entry when full"""
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                self._evict()
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def pop(self, key, default=None):
+        """Remove and return a cached value"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else default
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self):
+        """Drop expired entries, or the oldest one if none have expired"""
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            del self._data[key]
+        if not expired and self._data:
+            del self._data[next(iter(self._data))]
+
+class CacheManager:
+    """Cache shared by all workers through Redis (REDIS_URL), or per process without it"""
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url or os.getenv('REDIS_URL')
+        self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=0.5) if self.redis_url else None
+        self._local = TTLCache(maxsize=4096, ttl=60)
+
+    def get(self, key):
+        """Return a cached JSON-serializable value, or None on a miss or Redis error"""
+        if self._redis is None:
+            return self._local.get(key)
+        try:
+            raw = self._redis.get(key)
+        except redis.RedisError as e:
+            print(f"Error reading cache key {key}: {e}")
+            return None
+        return orjson.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=60):
+        """Cache a JSON-serializable value for ttl seconds"""
+        if self._redis is None:
+            self._local.set(key, value, ttl)
+            return
+        try:
+            self._redis.setex(key, ttl, orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS))
+        except redis.RedisError as e:
+            print(f"Error writing cache key {key}: {e}")
+
+    def set_many(self, mapping, ttl=60):
+        """Cache several JSON-serializable values for ttl seconds (one Redis round-trip)"""
+        if self._redis is None:
+            for key, value in mapping.items():
+                self._local.set(key, value, ttl)
+            return
+        try:
+            with self._redis.pipeline(transaction=False) as pipe:
+                for key, value in mapping.items():
+                    pipe.setex(key, ttl, orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS))
+                pipe.execute()
+        except redis.RedisError as e:
+            print(f"Error writing cache keys {list(mapping)}: {e}")
+
+    def delete(self, *keys):
+        """Invalidate cached keys"""
+        if self._redis is None:
+            for key in keys:
+                self._local.pop(key)
+            return
+        try:
+            self._redis.delete(*keys)
+        except redis.RedisError as e:
+            print(f"Error deleting cache keys {keys}: {e}")
+
+# Global cache manager instance
+cache_manager = CacheManager()
@@ -4,9 +4,35 @@ Encryption utilities for data at rest and in transit
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from functools import partial
 import base64
+import orjson
 import os
 
+try:
+    # Optional Rust implementation of the same Fernet token format (pip install rfernet)
+    import rfernet
+except ImportError:
+    rfernet = None
+
+# Plaintext bytes per token in encrypt_stream, so memory stays flat for large payloads
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Every Fernet token starts with the version byte 0x80 and a timestamp, i.e. "gA" in base64
+FERNET_TOKEN_PREFIX = b'gA'
+
+class _RustFernet:
+    """rfernet cipher behind the bytes-in/bytes-out API of cryptography's Fernet"""
+    
+    def __init__(self, key):
+        self._fernet = rfernet.Fernet(key.decode())
+    
+    def encrypt(self, data):
+        return self._fernet.encrypt(data).encode()
+    
+    def decrypt(self, token):
+        return self._fernet.decrypt(token.decode())
+
 class EncryptionManager:
     """Manages encryption for sensitive data"""
     
@@ -22,43 +48,69 @@ class EncryptionManager:
                 # Generate and store (in production, use proper key management)
                 self.key = Fernet.generate_key()
         
-        self.cipher = Fernet(self.key)
+        self.cipher = _RustFernet(self.key) if rfernet else Fernet(self.key)
     
     def encrypt(self, data):
         """Encrypt data"""
         if isinstance(data, str):
             data = data.encode()
-        encrypted = self.cipher.encrypt(data)
-        return base64.b64encode(encrypted).decode()
+        # Fernet tokens are already URL-safe base64 text
+        return self.cipher.encrypt(data).decode('ascii')
     
     def decrypt(self, encrypted_data):
         """Decrypt data"""
-        encrypted_bytes = base64.b64decode(encrypted_data.encode())
-        decrypted = self.cipher.decrypt(encrypted_bytes)
+        token = encrypted_data.encode('ascii')
+        if not token.startswith(FERNET_TOKEN_PREFIX):
+            # Written by older versions, which base64-encoded the token once more
+            token = base64.b64decode(token)
+        decrypted = self.cipher.decrypt(token)
         return decrypted.decode()
     
+    def encrypt_stream(self, src, dst, chunk_size=STREAM_CHUNK_SIZE):
+        """Encrypt a binary file object into dst as length-prefixed Fernet tokens, one per chunk"""
+        for chunk in iter(partial(src.read, chunk_size), b''):
+            token = self.cipher.encrypt(chunk)
+            dst.write(len(token).to_bytes(4, 'big'))
+            dst.write(token)
+    
+    def decrypt_stream(self, src, dst):
+        """Decrypt a stream written by encrypt_stream into the binary file object dst"""
+        while True:
+            header = src.read(4)
+            if not header:
+                break
+            length = int.from_bytes(header, 'big')
+            token = src.read(length)
+            if len(header) < 4 or len(token) < length:
+                raise ValueError("Truncated encrypted stream")
+            dst.write(self.cipher.decrypt(token))
+    
     def encrypt_dict(self, data_dict):
         """Encrypt dictionary values"""
-        encrypted = {}
-        for key, value in data_dict.items():
-            if isinstance(value, str) and value:
-                encrypted[key] = self.encrypt(value)
-            else:
-                encrypted[key] = value
-        return encrypted
+        encrypt = self.encrypt
+        return {key: encrypt(value) if isinstance(value, str) and value else value
+                for key, value in data_dict.items()}
+    
+    def _decrypt_or_original(self, value):
+        """Decrypt a value, returning it unchanged if it isn't a token we can decrypt"""
+        try:
+            return self.decrypt(value)
+        except Exception:
+            return value
     
     def decrypt_dict(self, encrypted_dict):
         """Decrypt dictionary values"""
-        decrypted = {}
-        for key, value in encrypted_dict.items():
-            if isinstance(value, str) and value:
-                try:
-                    decrypted[key] = self.decrypt(value)
-                except:
-                    decrypted[key] = value  # If decryption fails, return original
-            else:
-                decrypted[key] = value
-        return decrypted
+        decrypt = self._decrypt_or_original
+        return {key: decrypt(value) if isinstance(value, str) and value else value
+                for key, value in encrypted_dict.items()}
+    
+    def encrypt_bundle(self, data_dict):
+        """Encrypt a whole dictionary as one token (cheaper than encrypt_dict when values aren't queried separately)"""
+        return self.encrypt(orjson.dumps(data_dict, option=orjson.OPT_NON_STR_KEYS))
+    
+    def decrypt_bundle(self, token):
+        """Decrypt a token from encrypt_bundle back into a dictionary"""
+        return orjson.loads(self.decrypt(token))
 
 # Global encryption manager instance
 encryption_manager = EncryptionManager()
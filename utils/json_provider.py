@@ -0,0 +1,43 @@
+"""
+Fast JSON serialization for Flask responses
+"""
+from flask.json.provider import DefaultJSONProvider
+import orjson
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (datetimes serialize natively as ISO 8601)"""
+
+    sort_keys = False
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a JSON string"""
+        if kwargs:
+            # e.g. tojson(indent=2); orjson only supports its own options
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserialize JSON from a str or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Build a JSON response without going through an intermediate str"""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype
+        )
+
+class ORJSONSocketIO:
+    """orjson-backed stand-in for the json module python-socketio uses to encode packets"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        """Serialize obj to a JSON string (orjson output is already compact, as socketio asks via separators)"""
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=ORJSONProvider.option).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        """Deserialize a JSON packet payload"""
+        return orjson.loads(s)
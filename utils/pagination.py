@@ -0,0 +1,108 @@
+"""
+Keyset (cursor) pagination utilities
+"""
+from sqlalchemy import and_, or_
+from datetime import date, datetime
+import base64
+import json
+
+class KeysetPage:
+    """A single page of results with opaque next/prev cursors"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, per_page=20):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+def _encode_cursor(direction, values):
+    """Encode a direction and key values into a URL-safe cursor"""
+    payload = [direction, [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def _decode_cursor(cursor, columns):
+    """Decode a cursor back into (direction, values); invalid cursors start from the top"""
+    if not cursor:
+        return 'next', None
+    try:
+        direction, raw_values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if direction not in ('next', 'prev') or not isinstance(raw_values, list) \
+                or len(raw_values) != len(columns):
+            return 'next', None
+
+        values = []
+        for column, value in zip(columns, raw_values):
+            python_type = column.type.python_type
+            if value is not None and python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif value is not None and python_type is date:
+                value = date.fromisoformat(value)
+            elif value is not None and python_type is int:
+                value = int(value)
+            values.append(value)
+    except (ValueError, TypeError):
+        return 'next', None
+    return direction, values
+
+def _seek_clause(columns, values, before):
+    """Build a row-value comparison (c1, c2, ...) < (v1, v2, ...) portable across dialects"""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        compare = column < values[i] if before else column > values[i]
+        clauses.append(and_(*equal_prefix, compare))
+    return or_(*clauses)
+
+def keyset_paginate(query, columns, per_page=20, cursor=None):
+    """Paginate a query newest-first by seeking past a cursor instead of using OFFSET.
+
+    ``columns`` must uniquely order the rows, e.g. ``(Booking.created_at, Booking.id)``,
+    and should be backed by a composite index so each page is a single index range scan.
+    No COUNT(*) is issued.
+    """
+    direction, values = _decode_cursor(cursor, columns)
+
+    if values is not None:
+        query = query.filter(_seek_clause(columns, values, before=(direction == 'next')))
+
+    if direction == 'prev':
+        query = query.order_by(*[column.asc() for column in columns])
+    else:
+        query = query.order_by(*[column.desc() for column in columns])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([], per_page=per_page)
+
+    keys = [column.key for column in columns]
+    first = [getattr(rows[0], key) for key in keys]
+    last = [getattr(rows[-1], key) for key in keys]
+
+    has_next = has_more if direction == 'next' else True
+    has_prev = values is not None if direction == 'next' else has_more
+
+    return KeysetPage(
+        rows,
+        next_cursor=_encode_cursor('next', last) if has_next else None,
+        prev_cursor=_encode_cursor('prev', first) if has_prev else None,
+        per_page=per_page
+    )